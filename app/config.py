@@ -7,19 +7,143 @@ class Settings(BaseSettings):
     database_port: str = Field(alias="DATABASE_PORT") 
     database_hostname: str = Field(alias="DATABASE_HOST") 
     database_name: str = Field(alias="DATABASE_NAME") 
+    # Logs every SQL statement, slow; for debugging only
+    database_echo: bool = Field(default=False, alias="DATABASE_ECHO")
 
     secret_key: str = Field(alias="SECRET_KEY") 
     algorithm: str = Field(alias="ALGORITHM") 
     acess_token_expire_minutes: int = Field(alias="ACCESS_TOKEN_EXPIRE_MINUTES") 
 
+    # Authenticated user records are cached briefly; bcrypt runs on a small thread pool
+    auth_cache_ttl_seconds: int = Field(default=60, alias="AUTH_CACHE_TTL_SECONDS")
+    auth_cache_max_users: int = Field(default=10_000, alias="AUTH_CACHE_MAX_USERS")
+    auth_threads: int = Field(default=4, alias="AUTH_THREADS")
+    auth_max_pending: int = Field(default=64, alias="AUTH_MAX_PENDING")
+
+    # Request ids (X-Request-ID) attached to stage timings as exemplars
+    metrics_trace_ids: bool = Field(default=True, alias="METRICS_TRACE_IDS")
+
     gemini_api_key: str = Field(alias="GEMINI_API_KEY")
-    embedding_model: str = Field(alias="EMBEDDING_MODEL")
+    embedding_model: str = Field(default="sentence-transformers/all-mpnet-base-v2", alias="EMBEDDING_MODEL")
+    # torch, onnx (ONNX Runtime), int8 (torch with dynamically quantized linear layers),
+    # or fake for deterministic hash-based vectors (offline benchmarks)
+    embedding_backend: str = Field(default="torch", alias="EMBEDDING_BACKEND")
+    # Intra-op threads for the forward pass, 0 keeps the runtime default
+    embedding_threads: int = Field(default=0, alias="EMBEDDING_THREADS")
+    # Texts per forward pass inside the model's encode()
+    embedding_encode_batch_size: int = Field(default=32, alias="EMBEDDING_ENCODE_BATCH_SIZE")
+    # ONNX file in the model repo, e.g. onnx/model_qint8_avx512.onnx; empty uses onnx/model.onnx
+    embedding_onnx_file: str = Field(default="", alias="EMBEDDING_ONNX_FILE")
+    embedding_fake_dim: int = Field(default=768, alias="EMBEDDING_FAKE_DIM")
+    # Vector size; 0 reads it from the model when the first index is created
+    embedding_dim: int = Field(default=0, alias="EMBEDDING_DIM")
+    # Context packing: candidates retrieved per query, merged, de-duplicated and cut to a token budget
+    retrieval_candidates: int = Field(default=8, alias="RETRIEVAL_CANDIDATES")
+    context_max_tokens: int = Field(default=2000, alias="CONTEXT_MAX_TOKENS")
+    context_dedup_threshold: float = Field(default=0.8, alias="CONTEXT_DEDUP_THRESHOLD")
+
+    # Load the embedding and chat models in the background at startup instead of on first request
+    warm_up_on_startup: bool = Field(default=True, alias="WARM_UP_ON_STARTUP")
+
+    # Concurrent query embeddings are batched into one forward pass
+    embedding_batch_window_ms: float = Field(default=5.0, alias="EMBEDDING_BATCH_WINDOW_MS")
+    embedding_max_batch: int = Field(default=32, alias="EMBEDDING_MAX_BATCH")
+
+    # In-process TTL/LRU cache of query vectors and per-user top-k results
+    query_cache_max_entries: int = Field(default=10_000, alias="QUERY_CACHE_MAX_ENTRIES")
+    query_cache_ttl_seconds: int = Field(default=600, alias="QUERY_CACHE_TTL_SECONDS")
+
+    # Persistent chunk-embedding cache
+    embedding_cache_enabled: bool = Field(default=True, alias="EMBEDDING_CACHE_ENABLED")
+    embedding_cache_path: str = Field(default="cache/embeddings.sqlite3", alias="EMBEDDING_CACHE_PATH")
+    embedding_cache_max_entries: int = Field(default=500_000, alias="EMBEDDING_CACHE_MAX_ENTRIES")
+
+    # Vector index persistence
+    index_dir: str = Field(default="data/index", alias="INDEX_DIR")
+    index_mmap: bool = Field(default=True, alias="INDEX_MMAP")
+    index_wal_max_bytes: int = Field(default=64 * 1024 * 1024, alias="INDEX_WAL_MAX_BYTES")
+    # Search executor: FAISS queries run here, off the event loop; chat gets 429 beyond max pending
+    search_threads: int = Field(default=4, alias="SEARCH_THREADS")
+    search_max_pending: int = Field(default=64, alias="SEARCH_MAX_PENDING")
+    loop_lag_interval_seconds: float = Field(default=0.5, alias="LOOP_LAG_INTERVAL_SECONDS")
+
+    # Index type as a FAISS factory string: "Flat", "HNSW32,Flat", "IVF256,Flat", "IVF256,PQ32", ...
+    faiss_index_factory: str = Field(default="Flat", alias="FAISS_INDEX_FACTORY")
+    # Shards stay flat until they hold this many vectors, then the index above is trained
+    index_train_min_vectors: int = Field(default=10_000, alias="INDEX_TRAIN_MIN_VECTORS")
+    index_train_max_samples: int = Field(default=100_000, alias="INDEX_TRAIN_MAX_SAMPLES")
+    # Vector storage: "float32" (L2) or scalar-quantized "fp16" / "int8" searched by inner product
+    vector_storage: str = Field(default="float32", alias="VECTOR_STORAGE")
+    # Quantized indexes fetch k * factor candidates and re-rank them exactly (<= 1 disables)
+    vector_rerank_factor: int = Field(default=3, alias="VECTOR_RERANK_FACTOR")
+    # Default per-query search breadth for IVF / HNSW indexes
+    faiss_nprobe: int = Field(default=16, alias="FAISS_NPROBE")
+    faiss_ef_search: int = Field(default=64, alias="FAISS_EF_SEARCH")
+    # Searches scoped to some documents compare up to this many of their vectors directly,
+    # larger scopes go through the index with an ID filter
+    scoped_search_exact_max: int = Field(default=4096, alias="SCOPED_SEARCH_EXACT_MAX")
+    # Per-user shards are loaded on first use and unloaded when idle
+    index_max_loaded_shards: int = Field(default=256, alias="INDEX_MAX_LOADED_SHARDS")
+    index_shard_idle_seconds: int = Field(default=900, alias="INDEX_SHARD_IDLE_SECONDS")
+    # Compact a shard once this many deleted chunks (and this share of its vectors) are tombstones
+    index_compact_min_tombstones: int = Field(default=100, alias="INDEX_COMPACT_MIN_TOMBSTONES")
+    index_compact_ratio: float = Field(default=0.2, alias="INDEX_COMPACT_RATIO")
+    # Several API workers: "standalone" (each process owns its index, the default),
+    # "writer" (python -m app.indexer: runs ingestion and deletes, publishes snapshots)
+    # or "reader" (uvicorn workers: map published snapshots read-only, hand writes to the writer)
+    index_role: str = Field(default="standalone", alias="INDEX_ROLE")
+    # Readers look for a newly published snapshot at most this often
+    index_reload_interval_seconds: float = Field(default=1.0, alias="INDEX_RELOAD_INTERVAL_SECONDS")
+    # Superseded snapshots the writer leaves on disk for readers still loading them
+    index_keep_generations: int = Field(default=2, alias="INDEX_KEEP_GENERATIONS")
+
+    # "router": the model decides whether to retrieve (two LLM calls per question)
+    # "direct": always retrieve with the user message, then answer (one LLM call)
+    # "auto": direct, except small talk / conversation questions go through the router
+    graph_mode: str = Field(default="auto", alias="GRAPH_MODE")
+
+    # Conversation memory: "memory", "sqlite" or "postgres" (the app database)
+    checkpointer_backend: str = Field(default="memory", alias="CHECKPOINTER_BACKEND")
+    checkpointer_sqlite_path: str = Field(default="data/checkpoints.sqlite3", alias="CHECKPOINTER_SQLITE_PATH")
+    checkpointer_pool_size: int = Field(default=10, alias="CHECKPOINTER_POOL_SIZE")
+    # In-memory backend: idle conversations are forgotten
+    conversation_max_threads: int = Field(default=1000, alias="CONVERSATION_MAX_THREADS")
+    conversation_idle_seconds: int = Field(default=3600, alias="CONVERSATION_IDLE_SECONDS")
+    # History sent to the model is trimmed to this many (approximate) tokens
+    history_max_tokens: int = Field(default=3000, alias="HISTORY_MAX_TOKENS")
+    # Past this many stored messages, older turns are dropped (and summarized)
+    history_max_messages: int = Field(default=24, alias="HISTORY_MAX_MESSAGES")
+    history_keep_messages: int = Field(default=8, alias="HISTORY_KEEP_MESSAGES")
+    history_summarize: bool = Field(default=True, alias="HISTORY_SUMMARIZE")
 
     chunk_size: int = Field(alias="CHUNK_SIZE")
     chunk_overlap: int = Field(alias="CHUNK_OVERLAP")
 
     poppler_path: str = Field(alias="POPPLER_PATH")
 
+    # OCR: pages are rendered and recognized in batches across a process pool,
+    # so peak memory is roughly ocr_workers * ocr_batch_pages rendered pages
+    ocr_workers: int = Field(default=2, alias="OCR_WORKERS")
+    ocr_batch_pages: int = Field(default=4, alias="OCR_BATCH_PAGES")
+    ocr_dpi: int = Field(default=200, alias="OCR_DPI")
+    # Pages with less text than this that also contain images are OCR'd
+    ocr_min_text_chars: int = Field(default=20, alias="OCR_MIN_TEXT_CHARS")
+
+    # Uploads are streamed to content-addressed paths under upload_dir
+    upload_dir: str = Field(default="uploaded_files", alias="UPLOAD_DIR")
+    upload_chunk_bytes: int = Field(default=1024 * 1024, alias="UPLOAD_CHUNK_BYTES")
+    upload_max_bytes: int = Field(default=100 * 1024 * 1024, alias="UPLOAD_MAX_BYTES")
+
+    # Ingestion jobs
+    ingestion_max_concurrency: int = Field(default=2, alias="INGESTION_MAX_CONCURRENCY")
+    # Uploads beyond this many waiting jobs get 429
+    ingestion_max_queued: int = Field(default=20, alias="INGESTION_MAX_QUEUED")
+    ingestion_job_retention_seconds: int = Field(default=3600, alias="INGESTION_JOB_RETENTION_SECONDS")
+    embedding_batch_size: int = Field(default=64, alias="EMBEDDING_BATCH_SIZE")
+    # Reader/writer roles: queued uploads and deletes, and job status, are files shared through here
+    ingestion_spool_dir: str = Field(default="data/spool", alias="INGESTION_SPOOL_DIR")
+    ingestion_poll_seconds: float = Field(default=0.5, alias="INGESTION_POLL_SECONDS")
+
     class Config: 
         env_file = ".env" 
 
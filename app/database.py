@@ -1,18 +1,33 @@
-from sqlalchemy import create_engine 
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from .config import settings
+from .services import metrics
 
 # Database URL
 DATABASE_URL = f"postgresql+asyncpg://{settings.database_username}:{settings.database_password}@{settings.database_hostname}:{settings.database_port}/{settings.database_name}"
  
 # Create async engine
 engine = create_async_engine(DATABASE_URL, 
-                             echo=True, 
+                             echo=settings.database_echo, 
                              future=True
                              )
 
+# Time every statement for the db_query stage
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_start", None)
+    if start is not None:
+        metrics.observe("db_query", time.perf_counter() - start)
+
+
 # Create a session maker to interact with the database
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
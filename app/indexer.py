@@ -0,0 +1,43 @@
+"""Indexer process for multi-worker deployments
+
+    INDEX_ROLE=writer python -m app.indexer
+
+Runs the uploads and deletes that API workers started with INDEX_ROLE=reader
+queue in INGESTION_SPOOL_DIR, and publishes a new snapshot of every shard it
+changes. Run exactly one per INDEX_DIR.
+"""
+import asyncio
+import signal
+
+from .config import settings
+from .services import executors, ingestion
+from .services.embedding_service import embedding_service
+from .services.vector_store import WRITER, close_vector_store
+
+
+async def main():
+    if settings.index_role != WRITER:
+        raise SystemExit(f"The indexer needs INDEX_ROLE={WRITER}, not {settings.index_role}")
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+
+    print("Indexer starting...")
+    await loop.run_in_executor(None, embedding_service.warm_up)
+    print(f"Indexer watching {settings.ingestion_spool_dir}")
+    try:
+        await ingestion.serve()
+    finally:
+        print("Indexer shutting down...")
+        ingestion.shutdown()
+        executors.shutdown()
+        close_vector_store()
+        embedding_service.shutdown()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
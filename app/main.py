@@ -1,18 +1,59 @@
-from fastapi import FastAPI 
+import asyncio
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
 
 from .routers import chat, login, upload_document, user
+from .config import settings
+from .services import executors, ingestion, langgraph_agent, metrics
+from .services.embedding_service import embedding_service
+from .services.langgraph_agent import close_graph, init_graph
+from .services.vector_store import close_vector_store
 
 
 
+# Readiness: models loaded and warmed up. Liveness only needs the loop to answer
+ready = False
+
+
+async def warm_up(): 
+    """Load models off the event loop; the app serves /health meanwhile"""
+    global ready
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, langgraph_agent.warm_up)
+        await loop.run_in_executor(None, embedding_service.warm_up)
+    except Exception as e:
+        print(f"Warm-up failed: {e}")
+        return
+    ready = True
+    print("Ready") 
+
+
 @asynccontextmanager 
 async def lifespan(app: FastAPI): 
+    global ready
     # Startup 
     print("Starting up...") 
-    print("Ready") 
+    await init_graph()
+    executors.loop_lag.start()
+    warm_up_task = None
+    if settings.warm_up_on_startup:
+        warm_up_task = asyncio.create_task(warm_up())
+    else:
+        # Models load on first use
+        ready = True
     yield 
     print("Shutting down...")
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    executors.loop_lag.stop()
+    ingestion.shutdown()
+    executors.shutdown()
+    close_vector_store()
+    embedding_service.shutdown()
+    await close_graph()
 
 
 app = FastAPI(
@@ -29,6 +70,29 @@ origins = []
  
 
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Tag the request with a trace id, echoed back in X-Request-ID"""
+    if not settings.metrics_trace_ids:
+        return await call_next(request)
+    request_id = metrics.new_trace_id(request.headers.get("x-request-id"))
+    token = metrics.trace_id.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.trace_id.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.exception_handler(executors.Saturated)
+async def saturated_handler(request: Request, exc: executors.Saturated):
+    # Backpressure: the client should retry instead of piling up more work
+    return JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, 
+                        content={"detail": str(exc)}, 
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
 # Include routers 
 app.include_router(login.router)
 app.include_router(upload_document.router)
@@ -44,7 +108,32 @@ async def read_root():
     }
  
 
+@app.get("/health/live") 
+async def liveness(): 
+    return {"status": "ok"}
+
+
+@app.get("/health/ready") 
+async def readiness(): 
+    if not ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+                            content={"status": "starting"})
+    return {"status": "ready"}
+
+
 @app.get("/health") 
 async def health(): 
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "ready": ready,
+        "embedding_model_loaded": embedding_service.loaded,
+        "event_loop_lag": executors.loop_lag.stats(),
+        "search": executors.search.stats(),
+        "ingestion": ingestion.stats(),
+    }
+
 
+@app.get("/metrics") 
+async def prometheus_metrics(request: Request): 
+    body, content_type = metrics.render(request.headers.get("accept", ""))
+    return Response(content=body, media_type=content_type)
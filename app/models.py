@@ -1,4 +1,4 @@
-from sqlalchemy import DateTime, ForeignKey, func
+from sqlalchemy import JSON, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from datetime import datetime
 from typing import List, Optional
@@ -19,10 +19,17 @@ class User(Base):
 
 class Document(Base): 
     __tablename__ = "documents" 
+    # One document per user and content, enforced for concurrent uploads too
+    __table_args__ = (
+        Index("uq_documents_user_id_content_hash", "user_id", "content_hash", unique=True),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     filename: Mapped[str] = mapped_column(nullable=False) 
     file_path: Mapped[str] = mapped_column(nullable=False) 
+    content_hash: Mapped[Optional[str]] = mapped_column(index=True, nullable=True) 
+    # Vector store ids of the document's chunks, set once ingestion completes
+    chunk_ids: Mapped[Optional[List[str]]] = mapped_column(JSON, nullable=True) 
     uploade_date: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE")) 
 
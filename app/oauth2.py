@@ -5,7 +5,8 @@ import logging
 from sqlalchemy.ext.asyncio import AsyncSession
 from . import schemas, models, database
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import select
+from sqlalchemy import event, select
+from cachetools import TTLCache
 from .config import settings
 
 # Load environment variables 
@@ -15,6 +16,21 @@ ACESS_TOKEN_EXPIRE_MINUTES = settings.acess_token_expire_minutes
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login") 
 
+# Short-lived cache of authenticated users, saves a SELECT on every request
+_user_cache: TTLCache = TTLCache(maxsize=settings.auth_cache_max_users, 
+                                 ttl=settings.auth_cache_ttl_seconds)
+
+
+def invalidate_user(user_id: int): 
+    _user_cache.pop(user_id, None)
+
+
+# Any ORM change to a user drops its cached record
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _on_user_change(mapper, connection, target): 
+    invalidate_user(target.id)
+
 
 def create_access_token(data: dict): 
     to_encode = data.copy() 
@@ -51,6 +67,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme),
 
     token_data = verify_access_token(token, credentials_exception)
 
+    user = _user_cache.get(token_data.id)
+    if user is not None:
+        return user
+
     stmt = select(models.User).where(models.User.id == token_data.id)
     result = await db.execute(stmt)
     user = result.scalar_one_or_none()
@@ -59,4 +79,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme),
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail="User not found")
 
+    # Detached, so a rollback in this request can't expire the cached copy
+    db.expunge(user)
+    _user_cache[user.id] = user
     return user
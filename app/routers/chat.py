@@ -1,8 +1,10 @@
+import json
 from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
 from langchain_core.messages import HumanMessage
 
 from ..oauth2 import get_current_user
-from ..services.langgraph_agent import graph
+from ..services import executors, langgraph_agent
 from .. import schemas
 
 
@@ -11,25 +13,53 @@ router = APIRouter(
     tags=["Chat"]
 )  
 
+# Graph nodes whose model output is the answer shown to the user
+ANSWER_NODES = ("generate", "query_or_respond")
 
-@router.post("/", response_model=schemas.ChatResponse)
-async def chat(
-    payload: schemas.ChatRequest,
-    current_user: int = Depends(get_current_user)
-):
+
+def _graph_input(payload: schemas.ChatRequest, current_user) -> tuple[dict, dict]:
     # Create initial state 
     state = {
         "messages": [HumanMessage(content=payload.query)],
     }
-    # Create config with current user id as thread_id
-    config = {"configurable": {"thread_id": current_user.id}}   
+    # Create config with current user id as thread_id, 
+    # user_id scopes retrieval to the user's own documents, document_ids to some of them
+    config = {"configurable": {"thread_id": current_user.id, 
+                               "user_id": current_user.id, 
+                               "document_ids": payload.document_ids or None}}   
+    return state, config
+
 
+def _content_text(content) -> str:
+    """Extract text content from a message or message chunk"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        text_parts = [
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content 
+            if isinstance(block, str) or (isinstance(block, dict) and block.get("type") == "text")
+        ]
+        return "".join(text_parts)
+    return str(content)
+
+
+@router.post("/", response_model=schemas.ChatResponse)
+async def chat(
+    payload: schemas.ChatRequest,
+    current_user: int = Depends(get_current_user)
+):
+    # Fail fast with 429 rather than queueing behind a saturated search pool
+    executors.search.check_capacity()
+    state, config = _graph_input(payload, current_user)
 
     # Run graph with conifg for memory persistence
-    result = await graph.ainvoke(
+    result = await langgraph_agent.graph.ainvoke(
         state,
         config=config
     )
+    # Old turns are summarized off the response path
+    langgraph_agent.schedule_compaction(config)
 
     # Extract the last AI message
     ai_messages = [msg for msg in result["messages"] if msg.type == "ai"]
@@ -38,18 +68,56 @@ async def chat(
         return schemas.ChatResponse(response="No response generated")
     
     last_message = ai_messages[-1]
-    
-    # Extract text content
-    if isinstance(last_message.content, str):
-        response_text = last_message.content
-    elif isinstance(last_message.content, list):
-        text_parts = [
-            block.get("text", "") 
-            for block in last_message.content 
-            if isinstance(block, dict) and block.get("type") == "text"
-        ]
-        response_text = "".join(text_parts)
-    else:
-        response_text = str(last_message.content)
+    return schemas.ChatResponse(response=_content_text(last_message.content))
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/stream")
+async def chat_stream(
+    payload: schemas.ChatRequest,
+    current_user: int = Depends(get_current_user)
+):
+    """Stream the answer as server-sent events
+
+    Events, in order: `retrieval` (started / done with sources), `token`
+    (answer deltas from the model), then `done` with the full response,
+    or `error` if the graph failed.
+    """
+    executors.search.check_capacity()
+    state, config = _graph_input(payload, current_user)
+
+    async def events():
+        response_parts = []
+        try:
+            async for event in langgraph_agent.graph.astream_events(state, config=config, version="v2"):
+                kind = event["event"]
+
+                if kind == "on_tool_start" and event["name"] == "retrieve":
+                    yield _sse("retrieval", {"status": "started", 
+                                             "query": event["data"].get("input", {}).get("query")})
 
-    return schemas.ChatResponse(response=response_text)
\ No newline at end of file
+                elif kind == "on_tool_end" and event["name"] == "retrieve":
+                    docs = getattr(event["data"].get("output"), "artifact", None) or []
+                    yield _sse("retrieval", {"status": "done", 
+                                             "sources": [doc.metadata for doc in docs]})
+
+                elif kind == "on_chat_model_stream" \
+                        and event["metadata"].get("langgraph_node") in ANSWER_NODES:
+                    delta = _content_text(event["data"]["chunk"].content)
+                    if delta:
+                        response_parts.append(delta)
+                        yield _sse("token", {"delta": delta})
+
+            yield _sse("done", {"response": "".join(response_parts) or "No response generated"})
+            langgraph_agent.schedule_compaction(config)
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(), 
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -22,7 +22,7 @@ async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Asy
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail=f"Invalid Credentials") 
     # Verify the password
-    if not utils.verify(user_credentials.password, user.password): 
+    if not await utils.verify_async(user_credentials.password, user.password): 
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
                             detail=f"Invalid Credentials") 
     
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Response, status, UploadFile, File
 from pydantic import HttpUrl
+from pathlib import Path
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import os
-import aiofiles
-from sympy import det 
 
 from .. import models 
 from ..database import get_db 
 from .. import oauth2
-from ..services.document_processor import load_documents
-from ..services.vector_store import add_docs_to_vector_store
+from ..services import ingestion, query_cache, uploads, vector_store
+from ..services.embedding_cache import embedding_cache
+from ..services.uploads import content_path, discard_upload, lock_file, save_upload, store_upload
 from .. import schemas
 
 router = APIRouter(
@@ -17,8 +20,25 @@ router = APIRouter(
     tags=["Docs"]
     )
 
-@router.post("/upload") 
-async def upload_document(file: UploadFile= File(...), 
+
+async def _find_duplicate(db: AsyncSession, user_id: int, content_hash: str):
+    stmt = select(models.Document).where(models.Document.user_id == user_id, 
+                                         models.Document.content_hash == content_hash)
+    return (await db.execute(stmt)).scalars().first()
+
+
+def _duplicate(response: Response, existing: models.Document, filename: str) -> schemas.UploadAccepted:
+    job = ingestion.find_job(existing.id)
+    response.status_code = status.HTTP_200_OK
+    return schemas.UploadAccepted(job_id=job.job_id if job else None, 
+                                  document_id=existing.id, 
+                                  filename=filename, 
+                                  status="duplicate"
+                                  )
+
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.UploadAccepted) 
+async def upload_document(response: Response, 
+                          file: UploadFile= File(...), 
                           db: AsyncSession=Depends(get_db),
                           current_user: int=Depends(oauth2.get_current_user)
                           ): 
@@ -27,41 +47,128 @@ async def upload_document(file: UploadFile= File(...),
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
                             detail=f"Unsupported file type. Upload PDF or TXT only."
                             )
-    
-    os.makedirs("uploaded_files", exist_ok=True)
 
+    # Refuse with 429 before saving anything when the ingestion queue is full
+    ingestion.check_capacity()
+    
     safe_filename = os.path.basename(file.filename)
-    file_path = f"uploaded_files/{safe_filename}"
 
-    # Async file save
-    async with aiofiles.open(file_path, "wb") as f:
-        await f.write(await file.read())
+    # Streamed, size-limited save, moved to its content-addressed path below
+    tmp_path, content_hash, _ = await save_upload(file)
+    file_path = content_path(content_hash, Path(safe_filename).suffix.lower())
 
-    # Process the document
     try:
-        docs = load_documents(file_path)
-    except Exception as e: 
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                            detail=f"Document loading failed: {str(e)}"
+        await lock_file(db, file_path)
+        # Byte-identical re-upload: the document is already (being) ingested
+        existing = await _find_duplicate(db, current_user.id, content_hash)
+        if existing and existing.chunk_ids is None and ingestion.find_job(existing.id) is None:
+            # Its job was lost (jobs live in memory, e.g. a restart mid-ingest): ingest it again
+            store_upload(tmp_path, existing.file_path)
+            job = ingestion.submit(user_id=current_user.id, 
+                                   document_id=existing.id, 
+                                   filename=existing.filename, 
+                                   file_path=existing.file_path, 
+                                   restarted=True
+                                   )
+            return schemas.UploadAccepted(job_id=job.job_id, 
+                                          document_id=existing.id, 
+                                          filename=file.filename, 
+                                          status=job.status
+                                          )
+        if existing:
+            return _duplicate(response, existing, file.filename)
+
+        # Placed while holding the lock, so a delete can't remove it before the row exists
+        created = store_upload(tmp_path, file_path)
+
+        # Save metadata
+        new_doc = models.Document(filename=safe_filename, 
+                                  file_path=file_path,
+                                  content_hash=content_hash,
+                                  user_id=current_user.id
+                                  )
+        db.add(new_doc)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # The same bytes were uploaded concurrently under another file extension.
+            # The lock is held until the rollback, so nothing references the file yet
+            if created:
+                os.remove(file_path)
+            await db.rollback()
+            existing = await _find_duplicate(db, current_user.id, content_hash)
+            if existing is None:
+                raise
+            return _duplicate(response, existing, file.filename)
+        await db.refresh(new_doc)
+    finally:
+        await discard_upload(tmp_path)
+
+    # Parse -> split -> embed -> index runs in the background
+    job = ingestion.submit(user_id=current_user.id, 
+                           document_id=new_doc.id, 
+                           filename=safe_filename, 
+                           file_path=file_path
+                           )
+
+    return schemas.UploadAccepted(job_id=job.job_id, 
+                                  document_id=new_doc.id, 
+                                  filename=file.filename, 
+                                  status=job.status
+                                  )
+
+
+@router.delete("/{document_id}", status_code=status.HTTP_204_NO_CONTENT) 
+async def delete_document(document_id: int, 
+                          db: AsyncSession=Depends(get_db),
+                          current_user: int=Depends(oauth2.get_current_user)
+                          ): 
+    stmt = select(models.Document).where(models.Document.id == document_id, 
+                                         models.Document.user_id == current_user.id)
+    document = (await db.execute(stmt)).scalars().first()
+    if document is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Document not found"
                             )
-    try:
-        doc_ids = add_docs_to_vector_store(docs)
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-                            detail=f"Vector store insertion failed: {str(e)}"
+
+    job = ingestion.find_job(document_id)
+    if job is not None and not job.done:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, 
+                            detail="Document is still being ingested, try again when the job has finished"
                             )
 
-    # Save metadata
-    new_doc = models.Document(filename=safe_filename, 
-                              file_path=file_path,
-                              user_id=current_user.id
-                              )
+    loop = asyncio.get_running_loop()
+    chunk_ids = document.chunk_ids
+    if chunk_ids is None:
+        # Ingested before chunk ids were recorded: its chunks are the ones from its file
+        chunk_ids = await loop.run_in_executor(None, lambda: vector_store.find_chunk_ids(
+            current_user.id, source=document.file_path))
+    # Tombstones the vectors; the shard is compacted in the background once enough pile up.
+    # Reader workers hand this to the indexer, searches stop seeing the chunks once it publishes
+    await ingestion.remove_chunks(current_user.id, chunk_ids)
 
-    db.add(new_doc)
+    # Content-addressed files can be shared by documents of other users
+    await uploads.delete_document(db, document)
     await db.commit()
-    await db.refresh(new_doc)
 
-    return {"filename": file.filename, "document_ids": doc_ids}
+
+@router.get("/jobs/{job_id}", response_model=schemas.IngestionJobOut) 
+async def get_ingestion_job(job_id: str, 
+                            current_user: int=Depends(oauth2.get_current_user)
+                            ): 
+    job = ingestion.get_job(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
+                            detail="Ingestion job not found"
+                            )
+    return job
+
+
+@router.get("/embedding-cache") 
+async def get_embedding_cache_stats(current_user: int=Depends(oauth2.get_current_user)): 
+    if embedding_cache is None:
+        return {"enabled": False, "query_cache": query_cache.stats()}
+    return {"enabled": True, **embedding_cache.stats(), "query_cache": query_cache.stats()}
 
 
 # Test endpoint
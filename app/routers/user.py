@@ -15,7 +15,7 @@ router = APIRouter(
 @router.post("/", status_code=status.HTTP_201_CREATED, response_model=schemas.User) 
 async def create_user(user: schemas.UserCreate, db: AsyncSession=Depends(get_db)): 
     # has the password 
-    hashed_password = utils.hash(user.password) 
+    hashed_password = await utils.hash_async(user.password) 
     user.password = hashed_password
 
     new_user = models.User(**user.model_dump()) 
@@ -32,11 +32,34 @@ class TokenData(BaseModel):
 class DocumentOut(BaseModel): 
     filename: str 
     document_ids: list
+
+class UploadAccepted(BaseModel): 
+    job_id: Optional[str] = None 
+    document_id: int 
+    filename: str 
+    status: str 
+
+class IngestionJobOut(BaseModel): 
+    job_id: str 
+    document_id: int 
+    filename: str 
+    status: str 
+    stage: str 
+    pages_parsed: int 
+    chunks_total: int 
+    chunks_embedded: int 
+    chunks_indexed: int 
+    error: Optional[str] = None 
+    created_at: datetime 
+    finished_at: Optional[datetime] = None 
+    model_config = ConfigDict(from_attributes=True)
     
 
 # Chat Schemas 
 class ChatRequest(BaseModel): 
     query: str 
+    # Search only these documents; omitted or empty searches all of the user's documents
+    document_ids: Optional[list[int]] = None 
 
 class ChatResponse(BaseModel): 
     response: str
@@ -0,0 +1,131 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+from ..config import settings
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """InMemorySaver that forgets idle conversations and superseded checkpoints
+
+    Threads unused for CONVERSATION_IDLE_SECONDS, or beyond the
+    CONVERSATION_MAX_THREADS most recently used, are deleted. Within a thread
+    only the latest checkpoints are kept, along with the channel blobs they
+    reference.
+    """
+
+    def __init__(self, max_threads: int, idle_seconds: int, keep_checkpoints: int = 2):
+        super().__init__()
+        self.max_threads = max_threads
+        self.idle_seconds = idle_seconds
+        self.keep_checkpoints = keep_checkpoints
+        self._last_used: "OrderedDict[Any, float]" = OrderedDict()
+
+    def _touch(self, thread_id: Any) -> None:
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+
+        idle_before = time.monotonic() - self.idle_seconds
+        for idle_thread, last_used in list(self._last_used.items()):
+            if idle_thread == thread_id:
+                continue
+            if len(self._last_used) > self.max_threads or last_used < idle_before:
+                self.delete_thread(idle_thread)
+            else:
+                # Ordered by last use, the rest are more recent
+                break
+
+    def delete_thread(self, thread_id: Any) -> None:
+        self._last_used.pop(thread_id, None)
+        super().delete_thread(thread_id)
+
+    def _prune(self, thread_id: Any, checkpoint_ns: str) -> None:
+        """Drop all but the newest checkpoints of a thread and their orphaned writes/blobs"""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_checkpoints:
+            return
+
+        # Checkpoint ids are time-ordered
+        stale = sorted(checkpoints)[:-self.keep_checkpoints]
+        for checkpoint_id in stale:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        live_versions = set()
+        for checkpoint, _, _ in checkpoints.values():
+            for channel, version in self.serde.loads_typed(checkpoint)["channel_versions"].items():
+                live_versions.add((channel, version))
+        for key in [key for key in self.blobs if key[0] == thread_id and key[1] == checkpoint_ns]:
+            if (key[2], key[3]) not in live_versions:
+                del self.blobs[key]
+
+    def get_tuple(self, config):
+        self._touch(config["configurable"]["thread_id"])
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        self._touch(thread_id)
+        self._prune(thread_id, config["configurable"].get("checkpoint_ns", ""))
+        return next_config
+
+
+# Open connection or pool of the on-disk backends, closed on shutdown
+_resource: Optional[Any] = None
+
+
+def memory_checkpointer() -> BoundedInMemorySaver:
+    return BoundedInMemorySaver(max_threads=settings.conversation_max_threads,
+                                idle_seconds=settings.conversation_idle_seconds)
+
+
+async def open_checkpointer() -> BaseCheckpointSaver:
+    """Create the checkpointer selected by CHECKPOINTER_BACKEND"""
+    global _resource
+    backend = settings.checkpointer_backend
+
+    if backend == "memory":
+        return memory_checkpointer()
+
+    if backend == "sqlite":
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        if os.path.dirname(settings.checkpointer_sqlite_path):
+            os.makedirs(os.path.dirname(settings.checkpointer_sqlite_path), exist_ok=True)
+        _resource = await aiosqlite.connect(settings.checkpointer_sqlite_path)
+        saver = AsyncSqliteSaver(_resource)
+        await saver.setup()
+        return saver
+
+    if backend == "postgres":
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+        conninfo = (f"postgresql://{settings.database_username}:{settings.database_password}"
+                    f"@{settings.database_hostname}:{settings.database_port}/{settings.database_name}")
+        _resource = AsyncConnectionPool(
+            conninfo,
+            max_size=settings.checkpointer_pool_size,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+            open=False,
+        )
+        await _resource.open()
+        saver = AsyncPostgresSaver(_resource)
+        await saver.setup()
+        return saver
+
+    raise ValueError(f"Unsupported checkpointer backend: {backend}")
+
+
+async def close_checkpointer() -> None:
+    global _resource
+    if _resource is not None:
+        await _resource.close()
+        _resource = None
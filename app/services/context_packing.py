@@ -0,0 +1,107 @@
+import os
+import re
+from typing import Optional
+
+from langchain_core.documents import Document
+
+
+# Same estimate langchain's count_tokens_approximately uses for message history
+CHARS_PER_TOKEN = 4
+# Leftover budget below this is not worth a truncated chunk
+MIN_TRUNCATED_TOKENS = 50
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _span(doc: Document) -> Optional[tuple[int, int]]:
+    start = doc.metadata.get("start_index")
+    if start is None or start < 0:
+        return None
+    return start, start + len(doc.page_content)
+
+
+def merge_adjacent(docs: list[Document]) -> list[Document]:
+    """Join chunks of the same page whose character ranges overlap or touch
+
+    Splitting with chunk_overlap repeats text at every boundary; merging puts
+    it back together once. Results keep the rank of their best chunk.
+    """
+    groups: dict[tuple, list[tuple[int, Document]]] = {}
+    merged: list[tuple[int, Document]] = []
+    for rank, doc in enumerate(docs):
+        if _span(doc) is None:
+            merged.append((rank, doc))
+        else:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            groups.setdefault(key, []).append((rank, doc))
+
+    for chunks in groups.values():
+        chunks.sort(key=lambda item: item[1].metadata["start_index"])
+        rank, current = chunks[0]
+        start, end = _span(current)
+        text = current.page_content
+        for next_rank, doc in chunks[1:]:
+            next_start, next_end = _span(doc)
+            if next_start <= end:
+                # Append only the part past the current end
+                text += doc.page_content[end - next_start:]
+                end = max(end, next_end)
+                rank = min(rank, next_rank)
+                continue
+            merged.append((rank, Document(page_content=text, metadata={**current.metadata, "start_index": start})))
+            rank, current = next_rank, doc
+            start, end, text = next_start, next_end, doc.page_content
+        merged.append((rank, Document(page_content=text, metadata={**current.metadata, "start_index": start})))
+
+    return [doc for _, doc in sorted(merged, key=lambda item: item[0])]
+
+
+def _shingles(text: str, size: int = 5) -> set[tuple[str, ...]]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(docs: list[Document], threshold: float) -> list[Document]:
+    """Keep the higher-ranked of any two chunks whose word 5-gram overlap reaches the threshold"""
+    kept: list[tuple[Document, set]] = []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if any(len(shingles & other) / max(1, min(len(shingles), len(other))) >= threshold
+               for _, other in kept):
+            continue
+        kept.append((doc, shingles))
+    return [doc for doc, _ in kept]
+
+
+def pack(docs: list[Document], max_tokens: int, dedup_threshold: float) -> list[Document]:
+    """Merge, de-duplicate and keep the best-ranked chunks that fit in max_tokens"""
+    packed = []
+    budget = max_tokens
+    for doc in drop_near_duplicates(merge_adjacent(docs), dedup_threshold):
+        tokens = estimate_tokens(format_document(doc))
+        if tokens <= budget:
+            packed.append(doc)
+            budget -= tokens
+            continue
+        # Truncate the first chunk that doesn't fit, then stop
+        room = budget - estimate_tokens(format_document(Document(page_content="", metadata=doc.metadata)))
+        if room >= MIN_TRUNCATED_TOKENS:
+            text = doc.page_content[:room * CHARS_PER_TOKEN].rsplit(" ", 1)[0]
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+        break
+    return packed
+
+
+def format_document(doc: Document) -> str:
+    source = doc.metadata.get("filename") or os.path.basename(doc.metadata.get("source", "unknown"))
+    page = doc.metadata.get("page")
+    header = f"[{source}, page {page}]" if page is not None else f"[{source}]"
+    return f"{header}\n{doc.page_content}"
+
+
+def format_context(docs: list[Document]) -> str:
+    return "\n\n".join(format_document(doc) for doc in docs)
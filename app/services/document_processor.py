@@ -1,86 +1,204 @@
 import fitz 
+import time
+from collections import deque
 from pathlib import Path
-from pdf2image import convert_from_path
+from typing import Callable, Iterable, Iterator, Optional, Union
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 from langchain_core.documents import Document
 from ..config import settings
+from . import executors, metrics
 
 
-def extract_pdf_text(file_path: str) -> list[Document]:
-    """Extract text from a PDF using PyMuPDF"""
-    doc = fitz.open(file_path)
-    documents = []
+# Called once per page with its 1-based page number when the page's text is final
+PageCallback = Optional[Callable[[int], None]]
+
+# Values of the "extraction" metadata key
+EXTRACTED_TEXT = "text"
+EXTRACTED_OCR = "ocr"
+EXTRACTED_NONE = "none"
+
+# Large text files are read in blocks of about this many characters
+TXT_BLOCK_CHARS = 1_000_000
 
-    for i, page in enumerate(doc):
-        text = page.get_text("text")
-        documents.append(
-            Document(
-                page_content=text,
-                metadata={"source": file_path, "page": i + 1}
-            )
-        )
-    return documents
 
+def _page_has_text(page: fitz.Page, text: str) -> bool:
+    """A page keeps its text layer unless it is empty or an image with a stray caption"""
+    stripped = text.strip()
+    if not stripped:
+        return False
+    if len(stripped) < settings.ocr_min_text_chars and page.get_images(full=False):
+        return False
+    return True
 
-def extract_pdf_ocr(file_path: str) -> list[Document]:
-    """Extract text from a scanned PDF using OCR"""
-    print("OCR: Processing scanned PDF...")
-    images = convert_from_path(file_path, poppler_path=settings.poppler_path)
 
-    documents = []
-    for i, img in enumerate(images):
-        text = pytesseract.image_to_string(img)
-        documents.append(
-            Document(
+def iter_pdf_text(file_path: str) -> Iterator[Document]:
+    """Extract text from a PDF page by page using PyMuPDF, marking pages without usable text"""
+    with fitz.open(file_path) as doc:
+        for i, page in enumerate(doc):
+            with metrics.timed("extract_text"):
+                text = page.get_text("text")
+                extraction = EXTRACTED_TEXT if _page_has_text(page, text) else EXTRACTED_NONE
+            yield Document(
                 page_content=text,
-                metadata={"source": file_path, "page": i + 1}
+                metadata={"source": file_path, "page": i + 1, "extraction": extraction}
             )
-        )
-    return documents
 
 
-def process_pdf(file_path: str) -> list[Document]:
-    """Handle PDF processing with fallback to OCR if needed"""
-    try:
-        docs = extract_pdf_text(file_path)
-
-        # If all pages are empty → scanned pdf → OCR
-        if all(len(doc.page_content.strip()) == 0 for doc in docs):
-            raise ValueError("No text found in PDF, switching to OCR")
+def _ocr_page_range(file_path: str, first_page: int, last_page: int, 
+                    poppler_path: str, dpi: int) -> tuple[list[str], float]:
+    """Render and recognize one batch of pages (runs in a worker process)
+
+    Returns the page texts and the seconds spent, metrics live in the parent
+    """
+    start = time.perf_counter()
+    images = convert_from_path(file_path, 
+                               dpi=dpi, 
+                               first_page=first_page, 
+                               last_page=last_page, 
+                               poppler_path=poppler_path)
+    texts = [pytesseract.image_to_string(img) for img in images]
+    return texts, time.perf_counter() - start
+
+
+def _with_ocr(file_path: str, pages: Iterable[Union[Document, int]]) -> Iterator[Document]:
+    """Yield pages in order, OCR-ing the ones given as a page number instead of a Document
+
+    Consecutive OCR pages are recognized in batches on the process pool. At
+    most 2 * OCR_WORKERS batches are in flight and text pages waiting behind
+    one are buffered up to that many batches' worth of pages, so memory stays
+    bounded whatever the document's size. Closing the generator early cancels
+    the batches not started yet.
+    """
+    pool = executors.process_pool()
+    batch_pages = max(1, settings.ocr_batch_pages)
+    window = 2 * max(1, settings.ocr_workers)
+    # Ready Documents and (first page, future) of submitted batches, in page order
+    queue: deque = deque()
+    batch: list[int] = []
+
+    def submit():
+        queue.append((batch[0], pool.submit(_ocr_page_range, file_path, batch[0], batch[-1], 
+                                            settings.poppler_path, settings.ocr_dpi)))
+        batch.clear()
+
+    def emit(wait: bool) -> Iterator[Document]:
+        """Yield from the front of the queue, waiting for at most one batch"""
+        while queue:
+            if isinstance(queue[0], Document):
+                yield queue.popleft()
+                continue
+            first, future = queue[0]
+            if not (wait or future.done()):
+                return
+            texts, seconds = future.result()
+            queue.popleft()
+            wait = False
+            for offset, text in enumerate(texts):
+                metrics.observe("ocr_page", seconds / len(texts))
+                yield Document(
+                    page_content=text,
+                    metadata={"source": file_path, "page": first + offset, "extraction": EXTRACTED_OCR}
+                )
 
-        return docs
+    try:
+        for page in pages:
+            if isinstance(page, int):
+                if batch and (page != batch[-1] + 1 or len(batch) == batch_pages):
+                    submit()
+                batch.append(page)
+            else:
+                if batch:
+                    submit()
+                queue.append(page)
+            in_flight = sum(1 for entry in queue if not isinstance(entry, Document))
+            yield from emit(wait=in_flight >= window or len(queue) > window * batch_pages)
+        if batch:
+            submit()
+        while queue:
+            yield from emit(wait=True)
+    finally:
+        # The pool is shared, only this document's unstarted batches are dropped
+        for entry in queue:
+            if not isinstance(entry, Document):
+                entry[1].cancel()
+
+
+def iter_pdf_ocr(file_path: str, pages: Optional[list[int]] = None) -> Iterator[Document]:
+    """Extract text from a scanned PDF (or only the given pages) using OCR, in page order"""
+    if pages is None:
+        pages = list(range(1, pdfinfo_from_path(file_path, poppler_path=settings.poppler_path)["Pages"] + 1))
+    pages = sorted(pages)
+    print(f"OCR: Processing {len(pages)} page(s) of {file_path}")
+    yield from _with_ocr(file_path, pages)
+
+
+def iter_pdf(file_path: str) -> Iterator[Document]:
+    """Yield pages in page order, OCR-ing the ones without a text layer alongside"""
+    pages_read = 0
+    ocr_pages = 0
+
+    def pages() -> Iterator[Union[Document, int]]:
+        nonlocal pages_read, ocr_pages
+        for doc in iter_pdf_text(file_path):
+            pages_read += 1
+            if doc.metadata["extraction"] == EXTRACTED_NONE:
+                ocr_pages += 1
+                yield doc.metadata["page"]
+            else:
+                yield doc
 
+    try:
+        yield from _with_ocr(file_path, pages())
     except Exception:
-        return extract_pdf_ocr(file_path)
+        if pages_read:
+            raise
+        # PyMuPDF could not read the file → OCR everything
+        yield from iter_pdf_ocr(file_path)
+        return
+    if ocr_pages:
+        print(f"OCR: {ocr_pages} page(s) of {file_path} had no text layer")
 
 
-def process_txt(file_path: str) -> list[Document]:
-    """Process TXT files"""
+def iter_txt(file_path: str) -> Iterator[Document]:
+    """Read a TXT file in blocks ending at a line break
+
+    Each block carries its character offset in the file, chunk start_index
+    values are made absolute with it.
+    """
     print(f"Processing TXT: {file_path}")
+    offset = 0
     with open(file_path, "r", encoding="utf-8") as f:
-        text = f.read()
-
-    return [
-        Document(
-            page_content=text,
-            metadata={"source": file_path}
-        )
-    ]
+        while True:
+            block = f.read(TXT_BLOCK_CHARS)
+            if not block:
+                return
+            block += f.readline()
+            yield Document(
+                page_content=block,
+                metadata={"source": file_path, "extraction": EXTRACTED_TEXT, "offset": offset}
+            )
+            offset += len(block)
 
 
-def process_document(file_path: str) -> list[Document]:
-    """Process a document based on its file type"""
+def iter_documents(file_path: str, on_page: PageCallback = None) -> Iterator[Document]:
+    """Lazily extract a document based on its file type, one page (or text block) at a time"""
     ext = Path(file_path).suffix.lower()
 
     if ext == ".pdf":
-        return process_pdf(file_path)
-
-    if ext == ".txt":
-        return process_txt(file_path)
-
-    raise ValueError(f"Unsupported file type: {ext}")
-
-
-def load_documents(file_path: str) -> list[Document]:
-    """Load and process a document based on its type"""
-    return process_document(file_path)
+        pages = iter_pdf(file_path)
+    elif ext == ".txt":
+        pages = iter_txt(file_path)
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+    for number, doc in enumerate(pages, start=1):
+        metrics.PAGES.labels(doc.metadata["extraction"]).inc()
+        if on_page:
+            on_page(doc.metadata.get("page", number))
+        yield doc
+
+
+def load_documents(file_path: str, on_page: PageCallback = None) -> list[Document]:
+    """Load and process a whole document based on its type"""
+    return list(iter_documents(file_path, on_page))
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import xxhash
+from langchain_core.embeddings import Embeddings
+
+from ..config import settings
+
+
+class EmbeddingCache:
+    """On-disk cache of chunk embeddings keyed by embedding model + text hash
+
+    The database is opened on first use, importing the app creates no file.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """The database connection, opened on first use (caller holds self._lock)"""
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "  model TEXT NOT NULL,"
+                "  text_hash TEXT NOT NULL,"
+                "  vector BLOB NOT NULL,"
+                "  last_used REAL NOT NULL,"
+                "  PRIMARY KEY (model, text_hash))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            conn.commit()
+            self._db = conn
+        return self._db
+
+    @staticmethod
+    def key(text: str) -> str:
+        return xxhash.xxh3_128_hexdigest(text.encode("utf-8"))
+
+    def get_many(self, model: str, texts: list[str]) -> list[Optional[list[float]]]:
+        """Look up cached vectors, None where the text has not been embedded yet"""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model, *batch],
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, key) for key in found],
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None
+                for key in keys]
+
+    def put_many(self, model: str, texts: list[str], vectors: list[list[float]]) -> None:
+        now = time.time()
+        rows = [(model, self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries once the cache is over its size bound"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        # Trim a little extra so eviction doesn't run on every insert
+        excess += self.max_entries // 10
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self.evictions += excess
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends cache misses to the underlying model"""
+
+    def __init__(self, model: Embeddings, model_name: str, cache: EmbeddingCache):
+        self.model = model
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # Identical chunks within a batch are embedded once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique_texts, self.model.embed_documents(unique_texts)))
+            self.cache.put_many(self.model_name, unique_texts, [computed[t] for t in unique_texts])
+            for i in missing:
+                vectors[i] = computed[texts[i]]
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.model.embed_query(text)
+
+
+embedding_cache: Optional[EmbeddingCache] = (
+    EmbeddingCache(settings.embedding_cache_path, settings.embedding_cache_max_entries)
+    if settings.embedding_cache_enabled else None
+)
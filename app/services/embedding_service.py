@@ -0,0 +1,247 @@
+import asyncio
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from ..config import settings
+from .embedding_cache import CachedEmbeddings, embedding_cache
+
+
+# Lanes of the model thread, lower runs first
+QUERIES = 0
+DOCUMENTS = 1
+
+
+class _ModelThread:
+    """One thread running model calls, queued work from the query lane goes first"""
+
+    def __init__(self):
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, lane: int, fn: Callable) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding service is shut down")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding", daemon=True)
+                self._thread.start()
+            self._queue.put((lane, next(self._order), fn, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            _, _, fn, future = self._queue.get()
+            if fn is None:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self) -> None:
+        """Cancel the queued calls and stop the thread once the running one returns"""
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    _, _, _, future = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if future is not None:
+                    future.cancel()
+            self._queue.put((-1, next(self._order), None, None))
+
+
+class EmbeddingService(Embeddings):
+    """Owns the embedding model and runs every forward pass on one worker thread
+
+    Concurrent query embeddings are collected for up to EMBEDDING_BATCH_WINDOW_MS
+    (or until EMBEDDING_MAX_BATCH queries are waiting) and embedded in a single
+    batched call. Ingestion submits its chunks to the same thread, so the
+    model never runs two forward passes at once, but in slices of
+    EMBEDDING_ENCODE_BATCH_SIZE on a lower-priority lane: a chat query waits
+    for at most one slice, not for a whole upload's batch.
+
+    The model is loaded on first use, or up front by warm_up() at startup.
+    """
+
+    def __init__(self, loader: Callable[[], tuple[Embeddings, str]], 
+                 window_ms: float, max_batch: int):
+        self._loader = loader
+        self._model: Optional[Embeddings] = None
+        self._document_model: Optional[Embeddings] = None
+        self._load_lock = threading.Lock()
+        self._dimension: Optional[int] = None
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._thread = _ModelThread()
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _load(self) -> None:
+        with self._load_lock:
+            if self._model is not None:
+                return
+            model, model_name = self._loader()
+            # Chunks go through the cache wrapper, queries don't pollute it
+            self._document_model = model
+            if embedding_cache is not None:
+                self._document_model = CachedEmbeddings(model, model_name, embedding_cache)
+            self._model = model
+
+    @property
+    def model(self) -> Embeddings:
+        if self._model is None:
+            self._load()
+        return self._model
+
+    @property
+    def document_model(self) -> Embeddings:
+        if self._document_model is None:
+            self._load()
+        return self._document_model
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def warm_up(self) -> None:
+        """Load the model and run one forward pass so the first request doesn't pay for it"""
+        self.embed_query("warm up")
+
+    @property
+    def dimension(self) -> int:
+        """Vector size from EMBEDDING_DIM, else from the model itself"""
+        if self._dimension is None:
+            client = getattr(self.model, "_client", None) if not settings.embedding_dim else None
+            if settings.embedding_dim:
+                self._dimension = settings.embedding_dim
+            elif settings.embedding_backend == "fake":
+                self._dimension = settings.embedding_fake_dim
+            elif client is not None and client.get_sentence_embedding_dimension():
+                # sentence-transformers metadata, no forward pass needed
+                self._dimension = client.get_sentence_embedding_dimension()
+            else:
+                self._dimension = len(self.embed_query("Hello world"))
+        return self._dimension
+
+    # Sync API, for worker threads (ingestion)
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        size = max(1, settings.embedding_encode_batch_size)
+        futures = [self._thread.submit(DOCUMENTS, lambda part=texts[i:i + size]: 
+                                       self.document_model.embed_documents(part))
+                   for i in range(0, len(texts), size)]
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._thread.submit(QUERIES, lambda: self.model.embed_documents([text])).result()[0]
+
+    # Async API, for the event loop
+    async def aembed_query(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        texts = [text for text, _ in batch]
+        forward = asyncio.wrap_future(self._thread.submit(QUERIES, lambda: self.model.embed_documents(texts)))
+
+        def resolve(done: asyncio.Future):
+            for i, (_, future) in enumerate(batch):
+                if future.done():
+                    continue
+                if done.exception() is not None:
+                    future.set_exception(done.exception())
+                else:
+                    future.set_result(done.result()[i])
+
+        forward.add_done_callback(resolve)
+
+    def shutdown(self) -> None:
+        self._thread.shutdown()
+
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "int8", "fake")
+
+
+def embedding_cache_key(backend: str) -> str:
+    """Name chunk vectors are cached under; other backends drift, so they get their own entries"""
+    if backend == "torch":
+        return settings.embedding_model
+    if backend == "onnx" and settings.embedding_onnx_file:
+        return f"{settings.embedding_model}:onnx:{settings.embedding_onnx_file}"
+    return f"{settings.embedding_model}:{backend}"
+
+
+def load_embedding_model(backend: Optional[str] = None) -> tuple[Embeddings, str]:
+    """Build the model for EMBEDDING_BACKEND, returns it with its cache key name"""
+    backend = backend or settings.embedding_backend
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported embedding backend: {backend}")
+
+    if backend == "fake":
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+
+        # No download and no forward pass, vectors are a function of the text hash
+        return DeterministicFakeEmbedding(size=settings.embedding_fake_dim), f"fake-{settings.embedding_fake_dim}"
+
+    # Imported here: pulls in torch and sentence-transformers
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if settings.embedding_threads:
+        torch.set_num_threads(settings.embedding_threads)
+
+    model_kwargs = {}
+    if backend == "onnx":
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if settings.embedding_threads:
+            options.intra_op_num_threads = settings.embedding_threads
+        onnx_kwargs = {"provider": "CPUExecutionProvider", "session_options": options}
+        if settings.embedding_onnx_file:
+            onnx_kwargs["file_name"] = settings.embedding_onnx_file
+        model_kwargs = {"backend": "onnx", "model_kwargs": onnx_kwargs}
+
+    model = HuggingFaceEmbeddings(model_name=settings.embedding_model,
+                                  model_kwargs=model_kwargs,
+                                  encode_kwargs={"normalize_embeddings": True,
+                                                 "batch_size": settings.embedding_encode_batch_size}
+    )
+
+    if backend == "int8":
+        # Linear layers get int8 weights, activations are quantized on the fly
+        model._client = torch.ao.quantization.quantize_dynamic(model._client, 
+                                                                {torch.nn.Linear}, 
+                                                                dtype=torch.qint8)
+    return model, embedding_cache_key(backend)
+
+
+embedding_service = EmbeddingService(load_embedding_model,
+                                     window_ms=settings.embedding_batch_window_ms,
+                                     max_batch=settings.embedding_max_batch)
@@ -0,0 +1,128 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from ..config import settings
+
+
+T = TypeVar("T")
+
+
+class Saturated(Exception):
+    """Raised when a stage already has as much work in flight as it accepts"""
+
+    def __init__(self, stage: str, retry_after: int = 1):
+        super().__init__(f"{stage} is at capacity, retry later")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """An executor with admission control: at most max_pending calls running or queued"""
+
+    def __init__(self, name: str, executor: Executor, max_pending: int):
+        self.name = name
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = 0
+
+    def check_capacity(self) -> None:
+        if self.pending >= self.max_pending:
+            raise Saturated(self.name)
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """Run fn in the executor without blocking the event loop"""
+        self.check_capacity()
+        self.pending += 1
+        try:
+            # Carry the request's context (trace id) into the worker thread
+            call = functools.partial(contextvars.copy_context().run, fn, *args)
+            return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "max_pending": self.max_pending}
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# FAISS search and re-ranking for chat requests
+search = BoundedExecutor(
+    "search",
+    ThreadPoolExecutor(max_workers=settings.search_threads, thread_name_prefix="search"),
+    max_pending=settings.search_max_pending,
+)
+
+# bcrypt hashing / verification for login and sign-up
+auth = BoundedExecutor(
+    "auth",
+    ThreadPoolExecutor(max_workers=settings.auth_threads, thread_name_prefix="auth"),
+    max_pending=settings.auth_max_pending,
+)
+
+# Parse -> split -> embed -> index pipelines, one thread per running ingestion
+ingestion = ThreadPoolExecutor(max_workers=settings.ingestion_max_concurrency,
+                               thread_name_prefix="ingestion")
+
+# Chunk deletes, kept off the ingestion threads so they don't wait for a whole upload
+index_writes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-write")
+
+# OCR process pool, created on first use
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def process_pool() -> ProcessPoolExecutor:
+    """CPU-bound work that would hold the GIL (OCR rendering and recognition)"""
+    global _process_pool
+    if _process_pool is None:
+        # spawn, not fork: the parent holds torch and executor threads
+        _process_pool = ProcessPoolExecutor(max_workers=settings.ocr_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a short sleep"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last = 0.0
+        self.max = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.last = max(0.0, time.perf_counter() - start - self.interval)
+            self.max = max(self.max, self.last)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        return {"last_ms": round(self.last * 1000, 2), "max_ms": round(self.max * 1000, 2)}
+
+
+loop_lag = LoopLagMonitor(settings.loop_lag_interval_seconds)
+
+
+def shutdown() -> None:
+    global _process_pool
+    search.shutdown()
+    auth.shutdown()
+    ingestion.shutdown(wait=False, cancel_futures=True)
+    index_writes.shutdown(wait=False, cancel_futures=True)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
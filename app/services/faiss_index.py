@@ -0,0 +1,126 @@
+import faiss
+import numpy as np
+from typing import Optional
+
+
+FLAT = "Flat"
+
+# Metric names as stored in snapshot metadata
+L2 = "l2"
+INNER_PRODUCT = "ip"
+_METRICS = {L2: faiss.METRIC_L2, INNER_PRODUCT: faiss.METRIC_INNER_PRODUCT}
+
+# Vector storage modes: full float32 with L2, or scalar-quantized codes searched
+# by inner product (embeddings are normalized, so IP ranks like cosine)
+FLOAT32 = "float32"
+_SCALAR_QUANTIZERS = {"fp16": "SQfp16", "int8": "SQ8"}
+
+
+def resolve_factory(factory: str, storage: str) -> str:
+    """Swap the trailing Flat storage of a factory string for the scalar quantizer of the storage mode"""
+    if storage == FLOAT32:
+        return factory
+    if storage not in _SCALAR_QUANTIZERS:
+        raise ValueError(f"Unsupported vector storage: {storage}")
+    parts = factory.split(",")
+    if parts[-1] == FLAT:
+        parts[-1] = _SCALAR_QUANTIZERS[storage]
+    return ",".join(parts)
+
+
+def is_lossy(factory: str) -> bool:
+    """True when the index keeps compressed codes instead of the exact vectors"""
+    return any(part.startswith(("SQ", "PQ", "OPQ")) or "PQ" in part for part in factory.split(","))
+
+
+def storage_metric(storage: str) -> str:
+    return L2 if storage == FLOAT32 else INNER_PRODUCT
+
+
+def build_index(factory: str, dim: int, metric: str = L2) -> faiss.Index:
+    """Create an empty index from a FAISS factory string (e.g. "Flat", "HNSW32,Flat", "IVF256,PQ32")"""
+    return faiss.index_factory(dim, factory, _METRICS[metric])
+
+
+def needs_training(factory: str, dim: int, metric: str = L2) -> bool:
+    return not build_index(factory, dim, metric).is_trained
+
+
+def reconstruct(index: faiss.Index, start: int, count: int) -> np.ndarray:
+    """Copy stored vectors back out of an index (lossy for PQ/SQ codes)"""
+    if count <= 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(start, count)
+
+
+def train_and_fill(factory: str, metric: str, vectors: np.ndarray, 
+                   max_train_samples: int) -> faiss.Index:
+    """Build a new index of the requested type holding the given vectors"""
+    index = build_index(factory, vectors.shape[1], metric)
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > max_train_samples:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), max_train_samples, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+
+    # IVF indexes need a direct map to reconstruct vectors later
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index
+
+
+def exclude_ids(ids: set[int]) -> Optional[faiss.IDSelector]:
+    """Selector matching every position except the given ones, None when there are none"""
+    if not ids:
+        return None
+    return faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(ids, dtype=np.int64, count=len(ids))))
+
+
+def search_params(index: faiss.Index,
+                  nprobe: Optional[int] = None,
+                  ef_search: Optional[int] = None,
+                  selector: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """Per-query tuning knobs and ID filter for the index type, None when there is nothing to set
+
+    The selector must stay referenced until the search has run.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if not nprobe and selector is None:
+            return None
+        return faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe, sel=selector)
+    if isinstance(index, faiss.IndexHNSW):
+        if not ef_search and selector is None:
+            return None
+        return faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch, sel=selector)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+
+def include_ids(ids: list[int]) -> faiss.IDSelector:
+    """Selector matching only the given positions"""
+    return faiss.IDSelectorBatch(np.asarray(ids, dtype=np.int64))
+
+
+def exact_search(index: faiss.Index, metric: str, query: np.ndarray, 
+                 ids: list[int], k: int) -> np.ndarray:
+    """The k nearest of the given positions, compared one by one against their stored vectors
+
+    For a few thousand candidates this beats a filtered index search, which
+    for IVF / HNSW may also miss members of a small subset.
+    """
+    positions = np.asarray(ids, dtype=np.int64)
+    if len(positions) == 0:
+        return positions
+    return positions[nearest(index.reconstruct_batch(positions), metric, query, k)]
+
+
+def nearest(vectors: np.ndarray, metric: str, query: np.ndarray, k: int) -> np.ndarray:
+    """Rows of vectors closest to the query, best first"""
+    if metric == INNER_PRODUCT:
+        scores = vectors @ query
+    else:
+        scores = -np.sum((vectors - query) ** 2, axis=1)
+    return np.argsort(-scores)[:k]
@@ -0,0 +1,343 @@
+import json
+import os
+import pickle
+import shutil
+from typing import Iterator, Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+
+def _is_mapped(index: faiss.Index) -> bool:
+    """Whether a read_index with IO_FLAG_MMAP_IFC left the vectors in the file mapping"""
+    if faiss.try_extract_index_ivf(index) is not None:
+        return True
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return isinstance(index, faiss.IndexFlatCodes)
+
+
+def _fsync_path(path: str) -> None:
+    """Flush a file, or a directory's entries, to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ExactVectors:
+    """Full-precision copies of a quantized index's vectors, by index position
+
+    Rows saved with the last snapshot are memory-mapped from its vectors.npy,
+    rows added since are kept in memory until the next snapshot.
+    """
+
+    def __init__(self, dim: int, saved: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.saved = saved if saved is not None else np.empty((0, dim), dtype=np.float32)
+        self._added: list[np.ndarray] = []
+        self._count = len(self.saved)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, vectors) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._added.append(vectors)
+        self._count += len(vectors)
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        yield self.saved
+        yield from self._added
+
+    def get(self, positions) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(self._added) > 1:
+            self._added = [np.concatenate(self._added)]
+        vectors = np.empty((len(positions), self.dim), dtype=np.float32)
+        saved = positions < len(self.saved)
+        vectors[saved] = self.saved[positions[saved]]
+        if not saved.all():
+            vectors[~saved] = self._added[0][positions[~saved] - len(self.saved)]
+        return vectors
+
+
+class IndexPersistence:
+    """Snapshots + write-ahead log for one FAISS vector store
+
+    Layout of the directory:
+        CURRENT         generation number of the live snapshot
+        snapshot-<n>/   index.faiss, docstore.pkl, meta.json and, for
+                        quantized indexes, vectors.npy (the exact vectors)
+        wal-<n>.log     writes made after snapshot <n> was taken
+
+    A snapshot only becomes live once CURRENT is atomically replaced, so a
+    crash mid-snapshot leaves the previous generation and its WAL intact.
+
+    With read_only, only published snapshots are loaded (no WAL replay, no
+    writes): that is how other processes follow the one that writes. keep
+    is how many superseded snapshots stay on disk for them.
+    """
+
+    def __init__(self, directory: str, mmap: bool = True, 
+                 read_only: bool = False, keep: int = 0):
+        self.directory = directory
+        self.mmap = mmap
+        self.read_only = read_only
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        self.generation = self.read_generation(directory)
+        # Free-form info saved alongside the snapshot (e.g. the index factory string)
+        self.meta: dict = {}
+        # Exact vectors of the snapshot plus the WAL, None when the snapshot has none
+        self.vectors: Optional[ExactVectors] = None
+        self._wal = None
+        # End of the last intact WAL record, found by load()
+        self._wal_end = 0
+
+    # Paths
+    def _current_path(self) -> str:
+        return os.path.join(self.directory, "CURRENT")
+
+    def _snapshot_dir(self, generation: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{generation}")
+
+    def _wal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation}.log")
+
+    @staticmethod
+    def read_generation(directory: str) -> int:
+        """Generation of the live snapshot, 0 when none was written yet"""
+        try:
+            with open(os.path.join(directory, "CURRENT")) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @property
+    def wal_size(self) -> int:
+        try:
+            return os.path.getsize(self._wal_path(self.generation))
+        except FileNotFoundError:
+            return 0
+
+    # Loading
+    def _read_wal(self) -> Iterator[dict]:
+        """Records of the WAL up to a torn tail; self._wal_end is where the last intact one ends"""
+        self._wal_end = 0
+        try:
+            with open(self._wal_path(self.generation), "rb") as f:
+                while True:
+                    try:
+                        record = pickle.load(f)
+                    except EOFError:
+                        return
+                    except Exception:
+                        # Torn write at the tail of the log, everything before it is intact
+                        return
+                    self._wal_end = f.tell()
+                    yield record
+        except FileNotFoundError:
+            return
+
+    def _truncate_wal(self) -> None:
+        """Cut a torn tail off the WAL, so new records aren't appended after it"""
+        path = self._wal_path(self.generation)
+        try:
+            if os.path.getsize(path) <= self._wal_end:
+                return
+        except FileNotFoundError:
+            return
+        print(f"Dropping torn tail of {path} after byte {self._wal_end}")
+        with open(path, "r+b") as f:
+            f.truncate(self._wal_end)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self, store: FAISS) -> bool:
+        """Restore the snapshot into store and replay the WAL on top of it
+
+        Returns True when the loaded index is memory-mapped (read-only until
+        copied into memory with make_writable).
+        """
+        mmapped = False
+        self.vectors = ExactVectors(store.index.d)
+        while self.generation:
+            try:
+                self._load_snapshot(store)
+                mmapped = self.mmap and _is_mapped(store.index)
+                break
+            except FileNotFoundError:
+                if not self.read_only:
+                    break
+                # The writer published again and dropped this generation meanwhile
+                generation = self.read_generation(self.directory)
+                if generation == self.generation:
+                    break
+                self.generation = generation
+
+        if self.read_only:
+            return mmapped
+        for record in self._read_wal():
+            if mmapped:
+                mmapped = self.make_writable(store)
+            self.apply(store, record)
+            if record["op"] == "add" and self.vectors is not None:
+                self.vectors.append(record["embeddings"])
+        self._truncate_wal()
+        return mmapped
+
+    def _load_snapshot(self, store: FAISS) -> None:
+        snapshot = self._snapshot_dir(self.generation)
+        # MMAP_IFC maps flat/SQ/PQ codes and HNSW storage too, plain MMAP only IVF lists
+        flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if self.mmap else 0
+        with open(os.path.join(snapshot, "docstore.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        index = faiss.read_index(os.path.join(snapshot, "index.faiss"), flags)
+        store.index, store.docstore, store.index_to_docstore_id = index, docstore, index_to_docstore_id
+        try:
+            with open(os.path.join(snapshot, "meta.json")) as f:
+                self.meta = json.load(f)
+        except FileNotFoundError:
+            self.meta = {}
+        self.vectors = self._load_vectors(snapshot, index)
+
+    @staticmethod
+    def _load_vectors(snapshot: str, index: faiss.Index) -> Optional[ExactVectors]:
+        """The snapshot's exact vectors, always mapped since only a few rows are read at a time"""
+        try:
+            saved = np.load(os.path.join(snapshot, "vectors.npy"), mmap_mode="r")
+        except FileNotFoundError:
+            return None if index.ntotal else ExactVectors(index.d)
+        return ExactVectors(index.d, saved) if len(saved) == index.ntotal else None
+
+    def make_writable(self, store: FAISS) -> bool:
+        """Swap a memory-mapped index for an in-memory copy so it can be added to
+
+        The mapped index is still exactly the current snapshot, so it is read
+        again without mmap (clone_index can't copy mmapped IVF lists).
+        """
+        path = os.path.join(self._snapshot_dir(self.generation), "index.faiss")
+        store.index = faiss.read_index(path)
+        return False
+
+    @staticmethod
+    def apply(store: FAISS, record: dict) -> None:
+        if record["op"] == "add":
+            store.add_embeddings(
+                zip(record["texts"], record["embeddings"]),
+                metadatas=record["metadatas"],
+                ids=record["ids"],
+            )
+        elif record["op"] == "delete":
+            # Vectors stay in the index as tombstones until compaction,
+            # only their documents go
+            live = [doc_id for doc_id in record["ids"] if doc_id in store.docstore._dict]
+            if live:
+                store.docstore.delete(live)
+
+    # Writing
+    def append(self, record: dict) -> None:
+        """Durably log a write before it is applied to the index"""
+        if self.read_only:
+            raise RuntimeError(f"Index at {self.directory} is read-only")
+        if self._wal is None:
+            # Unbuffered: a failed write leaves nothing behind to be flushed later
+            self._wal = open(self._wal_path(self.generation), "ab", buffering=0)
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        start = self._wal.tell()
+        try:
+            if self._wal.write(data) != len(data):
+                raise OSError(f"Short write to {self._wal.name}")
+            os.fsync(self._wal.fileno())
+        except BaseException:
+            # Don't leave half a record for the next append to follow
+            os.ftruncate(self._wal.fileno(), start)
+            raise
+
+    def log_add(self, ids: list[str], texts: list[str],
+                embeddings: list[list[float]], metadatas: list[dict]) -> None:
+        self.append({
+            "op": "add",
+            "ids": ids,
+            "texts": texts,
+            "embeddings": np.asarray(embeddings, dtype=np.float32),
+            "metadatas": metadatas,
+        })
+
+    def log_delete(self, ids: list[str]) -> None:
+        self.append({"op": "delete", "ids": ids})
+
+    def snapshot(self, store: FAISS, meta: dict | None = None, 
+                 vectors: Optional[ExactVectors] = None) -> None:
+        """Write a full snapshot as the next generation and start a fresh WAL
+
+        vectors, when given, are saved with it and mapped back as self.vectors.
+        """
+        if self.read_only:
+            raise RuntimeError(f"Index at {self.directory} is read-only")
+        if meta is not None:
+            self.meta = meta
+        generation = self.generation + 1
+        snapshot = self._snapshot_dir(generation)
+        shutil.rmtree(snapshot, ignore_errors=True)
+        os.makedirs(snapshot)
+
+        faiss.write_index(store.index, os.path.join(snapshot, "index.faiss"))
+        with open(os.path.join(snapshot, "docstore.pkl"), "wb") as f:
+            pickle.dump((store.docstore, store.index_to_docstore_id), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(snapshot, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+        names = ["index.faiss", "docstore.pkl", "meta.json"]
+        if vectors is not None:
+            self._save_vectors(os.path.join(snapshot, "vectors.npy"), vectors)
+            names.append("vectors.npy")
+        open(self._wal_path(generation), "wb").close()
+
+        # The snapshot must be on disk before CURRENT points at it, the old WAL goes right after
+        for name in names:
+            _fsync_path(os.path.join(snapshot, name))
+        _fsync_path(snapshot)
+        _fsync_path(self._wal_path(generation))
+        _fsync_path(self.directory)
+
+        tmp = self._current_path() + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(generation))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._current_path())
+        _fsync_path(self.directory)
+
+        # Switch over, then drop the previous WAL and all but `keep` older snapshots
+        previous = self.generation
+        self.close()
+        self.generation = generation
+        self.vectors = self._load_vectors(snapshot, store.index) if vectors is not None else None
+        try:
+            os.remove(self._wal_path(previous))
+        except FileNotFoundError:
+            pass
+        for name in os.listdir(self.directory):
+            if name.startswith("snapshot-") and int(name.removeprefix("snapshot-")) < generation - self.keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    @staticmethod
+    def _save_vectors(path: str, vectors: ExactVectors) -> None:
+        """Copy the vectors into a .npy file part by part, without joining them in memory"""
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, 
+                                        shape=(len(vectors), vectors.dim))
+        start = 0
+        for chunk in vectors.chunks():
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        out.flush()
+        del out
+
+    def close(self) -> None:
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
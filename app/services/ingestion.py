@@ -0,0 +1,290 @@
+import asyncio
+import contextvars
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import update
+
+from .. import models
+from ..config import settings
+from ..database import AsyncSessionLocal
+from . import executors
+from .document_processor import iter_documents
+from .job_spool import JobSpool
+from .uploads import delete_document
+from .vector_store import (READ_ONLY, STANDALONE, add_docs_to_vector_store, delete_chunks, 
+                           find_chunk_ids, publish)
+
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+@dataclass
+class IngestionJob:
+    """Progress of one upload through parse -> split -> embed -> index"""
+    user_id: int
+    document_id: int
+    filename: str
+    file_path: str
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    stage: str = QUEUED
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    chunks_indexed: int = 0
+    doc_ids: list[str] = field(default_factory=list)
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (COMPLETED, FAILED)
+
+    def to_status(self) -> dict:
+        """What API workers see of the job (the chunk ids stay with the indexer)"""
+        status = asdict(self)
+        del status["doc_ids"]
+        return status
+
+    @classmethod
+    def from_status(cls, status: dict) -> "IngestionJob":
+        job = cls(**status)
+        job.created_at = datetime.fromisoformat(status["created_at"])
+        if status["finished_at"]:
+            job.finished_at = datetime.fromisoformat(status["finished_at"])
+        return job
+
+
+# Bounded worker pool, the semaphore keeps extra jobs queued instead of
+# piling up on the executor
+_slots = asyncio.Semaphore(settings.ingestion_max_concurrency)
+
+_jobs: dict[str, IngestionJob] = {}
+_tasks: set[asyncio.Task] = set()
+
+# Reader role: uploads and deletes are queued here for the indexer process
+# (writer role), which reports job status back through the same directory
+spool = JobSpool(settings.ingestion_spool_dir) if settings.index_role != STANDALONE else None
+
+
+def _run_pipeline(job: IngestionJob) -> None:
+    """Parse -> split -> embed -> index, streamed page by page, updating job progress as it goes"""
+    job.stage = "parsing"
+
+    def on_page(page: int):
+        job.pages_parsed += 1
+
+    # Lazy: pages are only extracted as the indexing loop asks for them
+    docs = iter_documents(job.file_path, on_page=on_page)
+
+    def on_progress(stage: str, count: int):
+        if stage == "split":
+            # Running total, the document's size isn't known up front
+            job.chunks_total += count
+            job.stage = "embedding"
+        elif stage == "embedded":
+            job.chunks_embedded += count
+            job.stage = "indexing"
+        elif stage == "indexed":
+            job.chunks_indexed += count
+            job.stage = "parsing"
+
+    # Chunks carry their document id, so they can be found and deleted with it
+    job.doc_ids = add_docs_to_vector_store(docs, job.user_id, on_progress=on_progress, 
+                                           metadata={"document_id": job.document_id, 
+                                                     "filename": job.filename})
+
+
+def _discard_chunks(job: IngestionJob) -> None:
+    """Remove whatever a failed job managed to index"""
+    try:
+        delete_chunks(job.user_id, find_chunk_ids(job.user_id, document_id=job.document_id))
+    except Exception as e:
+        print(f"Could not remove chunks of failed document {job.document_id}: {e}")
+
+
+async def _record_chunks(job: IngestionJob) -> None:
+    """Store the chunk ids on the document row, deletion needs them"""
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(models.Document)
+                              .where(models.Document.id == job.document_id)
+                              .values(chunk_ids=job.doc_ids))
+        await session.commit()
+
+
+async def _discard_document(document_id: int) -> None:
+    """Remove the metadata row of an upload that failed to ingest, and its file if no other row uses it"""
+    async with AsyncSessionLocal() as session:
+        document = await session.get(models.Document, document_id)
+        if document is not None:
+            await delete_document(session, document)
+            await session.commit()
+
+
+async def _run(job: IngestionJob, restarted: bool = False) -> None:
+    async with _slots:
+        job.status = RUNNING
+        loop = asyncio.get_running_loop()
+        try:
+            if restarted:
+                # Chunks indexed by the run that was lost would be there twice
+                await loop.run_in_executor(executors.ingestion, _discard_chunks, job)
+            # The upload's trace id follows the job into the worker thread
+            await loop.run_in_executor(executors.ingestion, 
+                                       contextvars.copy_context().run, _run_pipeline, job)
+            await _record_chunks(job)
+            job.status = COMPLETED
+            job.stage = COMPLETED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(getattr(e, "detail", e))
+            await loop.run_in_executor(executors.ingestion, _discard_chunks, job)
+            await _discard_document(job.document_id)
+        finally:
+            job.finished_at = datetime.now(timezone.utc)
+            if spool is not None:
+                await _publish(job)
+
+
+async def _publish(job: IngestionJob) -> None:
+    """Writer role: snapshot the shard for the readers, then report the final status"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(executors.ingestion, publish, job.user_id)
+    except Exception as e:
+        print(f"Could not publish the index of user {job.user_id}: {e}")
+    spool.write_status(job.to_status())
+
+
+def _prune_jobs() -> None:
+    """Forget finished jobs older than the retention window"""
+    cutoff = time.time() - settings.ingestion_job_retention_seconds
+    for job_id, job in list(_jobs.items()):
+        if job.done and job.finished_at.timestamp() < cutoff:
+            del _jobs[job_id]
+
+
+def check_capacity() -> None:
+    """Refuse new uploads once INGESTION_MAX_QUEUED jobs are already waiting"""
+    waiting = sum(1 for job in _all_jobs() if job.status == QUEUED)
+    if waiting >= settings.ingestion_max_queued:
+        raise executors.Saturated("ingestion", retry_after=30)
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def submit(user_id: int, document_id: int, filename: str, file_path: str, 
+           restarted: bool = False) -> IngestionJob:
+    """Queue a saved upload for background ingestion
+
+    restarted: an earlier job for the document was lost (e.g. in a restart),
+    its chunks are removed first.
+    """
+    job = IngestionJob(user_id=user_id, document_id=document_id,
+                       filename=filename, file_path=file_path)
+    if READ_ONLY:
+        spool.write_status(job.to_status())
+        spool.enqueue({"op": "ingest", "job": job.to_status(), "restarted": restarted})
+        return job
+
+    _prune_jobs()
+    _jobs[job.job_id] = job
+    _spawn(_run(job, restarted))
+    return job
+
+
+async def remove_chunks(user_id: int, ids: list[str]) -> None:
+    """Delete chunks from a user's index, through the indexer in the reader role"""
+    if READ_ONLY:
+        spool.enqueue({"op": "delete", "user_id": user_id, "ids": ids})
+        return
+    await asyncio.get_running_loop().run_in_executor(executors.index_writes, delete_chunks, user_id, ids)
+
+
+def _all_jobs() -> list[IngestionJob]:
+    if READ_ONLY:
+        return [IngestionJob.from_status(status) for status in spool.statuses()]
+    return list(_jobs.values())
+
+
+def get_job(job_id: str) -> Optional[IngestionJob]:
+    if READ_ONLY:
+        status = spool.read_status(job_id)
+        return IngestionJob.from_status(status) if status else None
+    return _jobs.get(job_id)
+
+
+def find_job(document_id: int) -> Optional[IngestionJob]:
+    """Most recent job for a document, if it is still remembered"""
+    if READ_ONLY:
+        matches = [IngestionJob.from_status(status) for status in spool.find_statuses(document_id)]
+    else:
+        matches = [job for job in _jobs.values() if job.document_id == document_id]
+    return max(matches, key=lambda job: job.created_at) if matches else None
+
+
+def stats() -> dict:
+    jobs = _all_jobs()
+    return {
+        "running": sum(1 for job in jobs if job.status == RUNNING),
+        "queued": sum(1 for job in jobs if job.status == QUEUED),
+        "max_running": settings.ingestion_max_concurrency,
+        "max_queued": settings.ingestion_max_queued,
+    }
+
+
+def shutdown() -> None:
+    """Drop jobs that have not started yet"""
+    for task in _tasks:
+        task.cancel()
+
+
+async def _serve_request(name: str, record: dict, restarted: bool = False) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        if record["op"] == "ingest":
+            job = IngestionJob.from_status(record["job"])
+            _jobs[job.job_id] = job
+            # Restarted: chunks indexed before the indexer stopped would be there twice
+            await _run(job, restarted or record.get("restarted", False))
+        elif record["op"] == "delete":
+            await loop.run_in_executor(executors.index_writes, delete_chunks, record["user_id"], record["ids"])
+            await loop.run_in_executor(executors.index_writes, publish, record["user_id"])
+    except Exception as e:
+        print(f"Queued {record['op']} request {name} failed: {e}")
+    # Not reached when cancelled at shutdown, the next run picks the request up again
+    spool.done(name)
+
+
+async def serve() -> None:
+    """Writer role: run the uploads and deletes queued by the API workers until cancelled"""
+    for name, record in spool.unfinished():
+        _spawn(_serve_request(name, record, restarted=True))
+
+    pruned_at = 0.0
+    while True:
+        for name, record in spool.claim():
+            _spawn(_serve_request(name, record))
+
+        # Progress of queued and running jobs, final states are written by _publish
+        for job in list(_jobs.values()):
+            if not job.done:
+                spool.write_status(job.to_status())
+
+        if time.monotonic() - pruned_at > 60:
+            _prune_jobs()
+            spool.prune(settings.ingestion_job_retention_seconds)
+            pruned_at = time.monotonic()
+        await asyncio.sleep(settings.ingestion_poll_seconds)
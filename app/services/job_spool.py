@@ -0,0 +1,96 @@
+import glob
+import json
+import os
+import time
+import uuid
+from typing import Iterator, Optional
+
+
+class JobSpool:
+    """File-based hand-off between the API workers and the indexer process
+
+    Layout of the directory:
+        queue/<ns>-<id>.json        requests waiting for the indexer, oldest first
+        claimed/<ns>-<id>.json      taken by the indexer, removed once handled
+        jobs/<document>-<job>.json  latest status of each ingestion job
+
+    Files are written under a temporary name and renamed into place, so a
+    reader never sees half of one.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        for name in ("queue", "claimed", "jobs"):
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.directory, *parts)
+
+    @staticmethod
+    def _write(path: str, data: dict) -> None:
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read(path: str) -> Optional[dict]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    # Requests
+    def enqueue(self, record: dict) -> None:
+        name = f"{time.time_ns()}-{uuid.uuid4().hex}.json"
+        self._write(self._path("queue", name), record)
+
+    def claim(self) -> list[tuple[str, dict]]:
+        """Move every waiting request to claimed/, oldest first"""
+        claimed = []
+        for path in sorted(glob.glob(self._path("queue", "*.json"))):
+            name = os.path.basename(path)
+            os.replace(path, self._path("claimed", name))
+            claimed.append((name, self._read(self._path("claimed", name))))
+        return claimed
+
+    def done(self, name: str) -> None:
+        try:
+            os.remove(self._path("claimed", name))
+        except FileNotFoundError:
+            pass
+
+    def unfinished(self) -> list[tuple[str, dict]]:
+        """Requests claimed by an indexer that stopped before handling them"""
+        return [(os.path.basename(path), self._read(path))
+                for path in sorted(glob.glob(self._path("claimed", "*.json")))]
+
+    # Job status
+    def write_status(self, status: dict) -> None:
+        self._write(self._path("jobs", f"{status['document_id']}-{status['job_id']}.json"), status)
+
+    def read_status(self, job_id: str) -> Optional[dict]:
+        for path in glob.glob(self._path("jobs", f"*-{job_id}.json")):
+            return self._read(path)
+        return None
+
+    def find_statuses(self, document_id: int) -> list[dict]:
+        paths = glob.glob(self._path("jobs", f"{document_id}-*.json"))
+        return [status for status in map(self._read, paths) if status is not None]
+
+    def statuses(self) -> Iterator[dict]:
+        for path in glob.glob(self._path("jobs", "*.json")):
+            status = self._read(path)
+            if status is not None:
+                yield status
+
+    def prune(self, older_than_seconds: float) -> None:
+        """Forget finished jobs whose status was last written before the window"""
+        cutoff = time.time() - older_than_seconds
+        for path in glob.glob(self._path("jobs", "*.json")):
+            try:
+                if os.path.getmtime(path) < cutoff and (self._read(path) or {}).get("finished_at"):
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -1,63 +1,178 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langgraph.graph import MessagesState, StateGraph, END 
-from langgraph.prebuilt import ToolNode, tools_condition 
-from langgraph.checkpoint.memory import InMemorySaver
-from langchain_core.messages import SystemMessage
+import asyncio
+import re
+import uuid
+from functools import lru_cache
+from langgraph.graph import MessagesState, StateGraph, START, END 
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool 
-from .vector_store import vector_store
+from . import context_packing, metrics
+from .executors import Saturated
+from .checkpointer import close_checkpointer, memory_checkpointer, open_checkpointer
+from .vector_store import asimilarity_search
 from ..config import settings
 
 
-# Initialize the model
-model = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", 
-    temperature=0, 
-    api_key=settings.gemini_api_key
-)
+# The chat model is created on first use (or by warm_up at startup)
+@lru_cache(maxsize=1)
+def get_model():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash", 
+        temperature=0, 
+        api_key=settings.gemini_api_key
+    )
+
+
+def warm_up() -> None:
+    get_model()
+
+
 
+class AgentState(MessagesState):
+    # Running summary of turns that were dropped from the message history
+    summary: str
 
 
-graph_builder = StateGraph(MessagesState) 
+graph_builder = StateGraph(AgentState) 
+
+
+def _with_history(state: AgentState, messages: list, system_content: str = "") -> list:
+    """Trim the conversation to the token budget and prepend the system prompt and summary
+
+    The latest question (and anything after it) is always sent, however long;
+    only the earlier turns are cut to what is left of the budget.
+    """
+    summary = state.get("summary")
+    if summary:
+        system_content = (f"{system_content}\n\n" if system_content else "") + \
+            f"Summary of the earlier conversation:\n{summary}"
+
+    last_human = max((i for i, msg in enumerate(messages) if msg.type == "human"), default=0)
+    earlier, current = messages[:last_human], messages[last_human:]
+    budget = settings.history_max_tokens - count_tokens_approximately(current)
+    history = trim_messages(
+        earlier,
+        max_tokens=budget,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+        allow_partial=False,
+    ) if budget > 0 else []
+    return ([SystemMessage(system_content)] if system_content else []) + history + current
 
 
 # Retrieval tool 
 @tool(response_format="content_and_artifact") 
-def retrieve(query: str): 
+async def retrieve(query: str, config: RunnableConfig): 
     """Retrieve relevant documents from vector store"""
     try:
-        # Check if vector store has documents
-        if vector_store.index.ntotal == 0:
-            return "No documents available in the knowledge base. Please upload documents first.", []
-        
-        retrieved_docs = vector_store.similarity_search(query, k=2)
+        # Only the current user's documents are searched, or the ones the request names
+        user_id = config["configurable"]["user_id"]
+        document_ids = config["configurable"].get("document_ids")
+        candidates = await asimilarity_search(user_id, query, k=settings.retrieval_candidates, 
+                                              document_ids=document_ids)
+        retrieved_docs = context_packing.pack(candidates, 
+                                              settings.context_max_tokens, 
+                                              settings.context_dedup_threshold)
         
+        if not retrieved_docs and document_ids:
+            return "No relevant passages found in the selected documents.", []
         if not retrieved_docs:
-            return "No relevant documents found for your query.", []
+            return "No relevant documents found. Please upload documents first.", []
         
-        serialized = "\n\n".join(
-            f"Source: {doc.metadata}\nContent: {doc.page_content}" 
-            for doc in retrieved_docs 
-        )
-        return serialized, retrieved_docs
+        return context_packing.format_context(retrieved_docs), retrieved_docs
     
+    except Saturated:
+        # Surfaces as 429 instead of an answer without context
+        raise
     except Exception as e:
         return f"Error retrieving documents: {str(e)}", []
 
 
 # Query node
-async def query_or_respond(state: MessagesState):
+async def query_or_respond(state: AgentState):
     """Generate tool call for retrieval or respond""" 
-    llm_with_tools = model.bind_tools([retrieve]) 
-    response = await llm_with_tools.ainvoke(state["messages"])
+    llm_with_tools = get_model().bind_tools([retrieve]) 
+    with metrics.timed("llm_query_or_respond"):
+        response = await llm_with_tools.ainvoke(_with_history(state, state["messages"]))
+    metrics.count_tokens("query_or_respond", response)
     return {"messages": [response]} 
 
 
-# Tool execution node 
-tools = ToolNode([retrieve])
+# Direct retrieval node: the single-LLM-call fast path
+async def retrieve_directly(state: AgentState):
+    """Call retrieve with the user's message as the query, without asking the model first"""
+    question = state["messages"][-1].content
+    tool_call = {
+        "name": retrieve.name, 
+        "args": {"query": question}, 
+        "id": f"direct-{uuid.uuid4().hex}", 
+        "type": "tool_call"
+    }
+    # Same message shape the router produces, so the history stays valid for either path
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+
+# Tool execution node. Not langgraph.prebuilt's ToolNode: importing that package loads
+# langchain_core's language models, which import transformers and torch with them
+async def tools(state: AgentState, config: RunnableConfig):
+    """Run the retrieve calls of the last AI message"""
+    async def call(tool_call: dict):
+        if tool_call["name"] != retrieve.name:
+            return ToolMessage(f"Unknown tool: {tool_call['name']}", 
+                               tool_call_id=tool_call["id"], status="error")
+        return await retrieve.ainvoke({**tool_call, "type": "tool_call"}, config)
+
+    messages = await asyncio.gather(*(call(tool_call) for tool_call in state["messages"][-1].tool_calls))
+    return {"messages": list(messages)}
+
+
+def has_tool_calls(state: AgentState) -> str:
+    """Run the tools the router asked for, or end with its direct answer"""
+    return "tools" if getattr(state["messages"][-1], "tool_calls", None) else END
+
+
+# Small talk and questions about the conversation itself go through the router
+_SMALL_TALK = re.compile(
+    r"^(hi|hello|hey|yo|thanks|thank you|thx|ok|okay|cool|great|nice|bye|goodbye|"
+    r"good (morning|afternoon|evening)|how are you|who are you|what can you do)\b",
+    re.IGNORECASE,
+)
+_ABOUT_CONVERSATION = re.compile(
+    r"\b(you said|your (last|previous) (answer|reply|message)|i (just )?asked|"
+    r"earlier in (this|our) (chat|conversation)|summari[sz]e (this|our) (chat|conversation))\b",
+    re.IGNORECASE,
+)
+
+
+def is_conversational(text: str) -> bool:
+    """Cheap local check for turns that don't need document retrieval"""
+    text = text.strip()
+    if not text:
+        return True
+    # "hi" is small talk, "hi, what does clause 5 say?" is a question
+    if _SMALL_TALK.search(text) and len(text.split()) <= 5:
+        return True
+    return bool(_ABOUT_CONVERSATION.search(text))
+
+
+def route_question(state: AgentState) -> str:
+    """Pick the entry node according to GRAPH_MODE"""
+    if settings.graph_mode == "router":
+        return "query_or_respond"
+    if settings.graph_mode == "direct":
+        return "retrieve_directly"
+
+    content = state["messages"][-1].content
+    question = content if isinstance(content, str) else str(content)
+    return "query_or_respond" if is_conversational(question) else "retrieve_directly"
 
 
 # Generate answer node
-async def generate(state: MessagesState): 
+async def generate(state: AgentState): 
     recent_tool_messages = [] 
     for message in reversed(state["messages"]): 
         if message.type == "tool": 
@@ -66,7 +181,13 @@ async def generate(state: MessagesState):
             break 
     tool_messages = recent_tool_messages[::-1] 
     
-    docs_content = "\n\n".join(doc.content for doc in tool_messages)
+    # Several retrieve calls are packed together so the prompt stays within budget
+    docs = [doc for msg in tool_messages for doc in (msg.artifact or [])]
+    if docs:
+        docs_content = context_packing.format_context(
+            context_packing.pack(docs, settings.context_max_tokens, settings.context_dedup_threshold))
+    else:
+        docs_content = "\n\n".join(msg.content for msg in tool_messages)
     system_message_content = (
         "You are an assistant for question-answering tasks. "
         "Use the following pieces of retrieved context to answer concisely.\n\n"
@@ -77,25 +198,111 @@ async def generate(state: MessagesState):
         if msg.type in ("human", "system") or 
            (msg.type == "ai" and not msg.tool_calls)
     ] 
-    prompt = [SystemMessage(system_message_content)] + conversation_message
-    response = await model.ainvoke(prompt) 
+    prompt = _with_history(state, conversation_message, system_message_content)
+    with metrics.timed("llm_generate"):
+        response = await get_model().ainvoke(prompt) 
+    metrics.count_tokens("generate", response)
     return {"messages": [response]}
 
 
+# History compaction, run after the answer has been returned
+async def compact_history(state: AgentState) -> dict: 
+    """State update dropping old turns from the stored history, folded into the running summary"""
+    messages = state["messages"]
+
+    # Cut at a human message so tool calls stay next to their results
+    cut = len(messages) - settings.history_keep_messages
+    while cut > 0 and messages[cut].type != "human":
+        cut -= 1
+    if cut <= 0:
+        return {}
+
+    old_messages = messages[:cut]
+    update = {"messages": [RemoveMessage(id=msg.id) for msg in old_messages]}
+
+    if settings.history_summarize:
+        transcript = "\n".join(
+            f"{msg.type}: {msg.text}" for msg in old_messages
+            if msg.type == "human" or (msg.type == "ai" and not msg.tool_calls)
+        )
+        summary = state.get("summary") or "(none)"
+        with metrics.timed("llm_compact_history"):
+            response = await get_model().ainvoke([HumanMessage(
+                "Update the summary of this conversation with the new lines. "
+                "Keep facts, names, numbers and open questions; be brief.\n\n"
+                f"Current summary:\n{summary}\n\nNew lines:\n{transcript}"
+            )])
+        metrics.count_tokens("compact_history", response)
+        update["summary"] = response.text
+
+    return update
+
+
+# Threads with a compaction in flight, and the tasks running them
+_compacting: set = set()
+_compaction_tasks: set[asyncio.Task] = set()
+
+
+def schedule_compaction(config: dict) -> None:
+    """Compact the thread's history in the background once it grows past HISTORY_MAX_MESSAGES
+
+    Called after a turn has finished, so the summarization call never
+    delays an answer.
+    """
+    thread_id = config["configurable"]["thread_id"]
+    if thread_id in _compacting:
+        return
+    _compacting.add(thread_id)
+    task = asyncio.create_task(_compact(config))
+    _compaction_tasks.add(task)
+    task.add_done_callback(_compaction_tasks.discard)
+
+
+async def _compact(config: dict) -> None:
+    thread_id = config["configurable"]["thread_id"]
+    try:
+        snapshot = await graph.aget_state(config)
+        if len(snapshot.values.get("messages", [])) > settings.history_max_messages:
+            update = await compact_history(snapshot.values)
+            if update:
+                await graph.aupdate_state(config, update, as_node="generate")
+    except Exception as e:
+        print(f"History compaction failed for thread {thread_id}: {e}")
+    finally:
+        _compacting.discard(thread_id)
+
+
 # Graph construction 
 graph_builder.add_node(query_or_respond) 
+graph_builder.add_node(retrieve_directly) 
 graph_builder.add_node(tools)
 graph_builder.add_node(generate) 
 
-graph_builder.set_entry_point("query_or_respond") 
+graph_builder.add_conditional_edges(
+    START, 
+    route_question, 
+    ["query_or_respond", "retrieve_directly"]
+)
+graph_builder.add_edge("retrieve_directly", "tools") 
 graph_builder.add_conditional_edges(
     "query_or_respond", 
-    tools_condition, 
-    {END: END, "tools": "tools"}
+    has_tool_calls, 
+    ["tools", END]
 )
 graph_builder.add_edge("tools", "generate") 
 graph_builder.add_edge("generate", END) 
 
-# In-memory checkpointer 
-memory = InMemorySaver()
-graph = graph_builder.compile(checkpointer=memory)
\ No newline at end of file
+# Bounded in-memory checkpointer until init_graph() opens the configured backend
+graph = graph_builder.compile(checkpointer=memory_checkpointer())
+
+
+async def init_graph() -> None:
+    """Recompile the graph with the checkpointer selected by CHECKPOINTER_BACKEND"""
+    global graph
+    graph = graph_builder.compile(checkpointer=await open_checkpointer())
+
+
+async def close_graph() -> None:
+    for task in _compaction_tasks:
+        task.cancel()
+    await close_checkpointer()
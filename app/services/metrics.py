@@ -0,0 +1,61 @@
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from prometheus_client import REGISTRY, Counter, Histogram, exposition
+from prometheus_client.openmetrics import exposition as openmetrics_exposition
+
+from ..config import settings
+
+
+# Seconds per stage: upload_write, extract_text, ocr_page, split, embed, index_add,
+# query_embed, faiss_search, llm_<node>, db_query
+STAGE_SECONDS = Histogram(
+    "askpdf_stage_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+PAGES = Counter("askpdf_pages", "Pages extracted from uploads", ["extraction"])
+CHUNKS = Counter("askpdf_chunks", "Chunks through the ingestion pipeline", ["stage"])
+TOKENS = Counter("askpdf_llm_tokens", "Tokens used by LLM calls", ["node", "kind"])
+
+# Set per request by the trace middleware, follows work into executor threads
+trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+
+def new_trace_id(incoming: Optional[str] = None) -> str:
+    """Reuse the caller's request id when it sent one"""
+    return incoming[:64] if incoming else uuid.uuid4().hex
+
+
+def observe(stage: str, seconds: float) -> None:
+    current = trace_id.get()
+    # Exemplars link a slow bucket to the request that landed in it (OpenMetrics only)
+    STAGE_SECONDS.labels(stage).observe(seconds, exemplar={"trace_id": current} if current else None)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def count_tokens(node: str, message) -> None:
+    """Record the usage metadata the model returned with a message"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            TOKENS.labels(node, kind.removesuffix("_tokens")).inc(usage[kind])
+
+
+def render(accept: str) -> tuple[bytes, str]:
+    """Exposition in the format the scraper asked for"""
+    if settings.metrics_trace_ids and "application/openmetrics-text" in accept:
+        return openmetrics_exposition.generate_latest(REGISTRY), openmetrics_exposition.CONTENT_TYPE_LATEST
+    return exposition.generate_latest(REGISTRY), exposition.CONTENT_TYPE_LATEST
@@ -0,0 +1,87 @@
+import re
+import threading
+from typing import Hashable, Optional
+
+from cachetools import TTLCache
+from langchain_core.documents import Document
+
+from ..config import settings
+
+
+# Query vectors by normalized text, shared by all users
+_vectors: TTLCache = TTLCache(maxsize=settings.query_cache_max_entries,
+                              ttl=settings.query_cache_ttl_seconds)
+# Top-k results by (user, index version, normalized text, search options)
+_results: TTLCache = TTLCache(maxsize=settings.query_cache_max_entries,
+                              ttl=settings.query_cache_ttl_seconds)
+# Bumped on every write to a user's index, so stale results can never match
+_versions: dict[int, int] = {}
+# cachetools caches are not thread-safe, searches run in worker threads
+_lock = threading.Lock()
+
+hits = 0
+misses = 0
+
+
+def normalize_query(text: str) -> str:
+    """Case, whitespace and trailing punctuation don't change what is being asked"""
+    return re.sub(r"\s+", " ", text).strip().strip("?!.").strip().lower()
+
+
+def index_version(user_id: int) -> int:
+    with _lock:
+        return _versions.get(user_id, 0)
+
+
+def get_query_vector(query: str) -> Optional[list[float]]:
+    with _lock:
+        return _vectors.get(normalize_query(query))
+
+
+def put_query_vector(query: str, vector: list[float]) -> None:
+    with _lock:
+        _vectors[normalize_query(query)] = vector
+
+
+def results_key(user_id: int, query: str, *options: Hashable) -> tuple:
+    return (user_id, index_version(user_id), normalize_query(query), *options)
+
+
+def get_results(key: tuple) -> Optional[list[Document]]:
+    global hits, misses
+    with _lock:
+        docs = _results.get(key)
+        if docs is None:
+            misses += 1
+        else:
+            hits += 1
+        return docs
+
+
+def put_results(key: tuple, docs: list[Document]) -> None:
+    with _lock:
+        # Skip results computed against an index that changed mid-search
+        if key[1] == _versions.get(key[0], 0):
+            _results[key] = docs
+
+
+def invalidate_user(user_id: int) -> None:
+    """Make a user's cached results unreachable after their index changed
+
+    The version is part of every key, so old entries can no longer match;
+    they age out through the TTL / LRU instead of being scanned for here.
+    """
+    with _lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = hits + misses
+        return {
+            "query_vectors": len(_vectors),
+            "results": len(_results),
+            "result_hits": hits,
+            "result_misses": misses,
+            "result_hit_rate": hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,86 @@
+import os
+import uuid
+
+import aiofiles
+import aiofiles.os
+import xxhash
+from fastapi import HTTPException, UploadFile, status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .. import models
+from ..config import settings
+from . import metrics
+
+
+def content_path(content_hash: str, suffix: str) -> str:
+    """Content-addressed location of an upload: <upload_dir>/<ab>/<hash><suffix>"""
+    return os.path.join(settings.upload_dir, content_hash[:2], f"{content_hash}{suffix}")
+
+
+async def save_upload(file: UploadFile) -> tuple[str, str, int]:
+    """Stream an upload to a temporary file in fixed-size chunks, hashing it on the way
+
+    Returns (tmp_path, content_hash, size). store_upload then moves it to its
+    content-addressed path, discard_upload drops it.
+    """
+    tmp_dir = os.path.join(settings.upload_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    hasher = xxhash.xxh3_128()
+    size = 0
+    try:
+        with metrics.timed("upload_write"):
+            async with aiofiles.open(tmp_path, "wb") as f:
+                while chunk := await file.read(settings.upload_chunk_bytes):
+                    size += len(chunk)
+                    if size > settings.upload_max_bytes:
+                        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                            detail=f"File exceeds the {settings.upload_max_bytes} byte upload limit")
+                    hasher.update(chunk)
+                    await f.write(chunk)
+    except BaseException:
+        await aiofiles.os.remove(tmp_path)
+        raise
+
+    return tmp_path, hasher.hexdigest(), size
+
+
+def store_upload(tmp_path: str, file_path: str) -> bool:
+    """Move a saved upload to its content-addressed path, returns False when the same bytes were already stored"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if os.path.exists(file_path):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, file_path)
+    return True
+
+
+async def discard_upload(tmp_path: str) -> None:
+    try:
+        await aiofiles.os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+async def lock_file(db: AsyncSession, file_path: str) -> None:
+    """Serialize transactions that add or drop references to a stored file, until commit/rollback
+
+    Content-addressed files are shared, so an upload placing one and a delete
+    removing its last reference must not interleave.
+    """
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(file_path))))
+
+
+async def delete_document(db: AsyncSession, document: models.Document) -> None:
+    """Delete a document row, and its file when no other row references it
+
+    The file goes before the caller commits, while the lock is still held.
+    """
+    await lock_file(db, document.file_path)
+    await db.delete(document)
+    await db.flush()
+    stmt = select(func.count()).select_from(models.Document).where(models.Document.file_path == document.file_path)
+    if (await db.execute(stmt)).scalar_one() == 0 and os.path.exists(document.file_path):
+        os.remove(document.file_path)
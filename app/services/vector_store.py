@@ -1,48 +1,667 @@
-import faiss
-from typing import List
+import numpy as np
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional
 from fastapi import HTTPException, status
-from grpc import Status
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from sympy import det
 
 from .. config import settings 
+from . import executors, faiss_index, metrics, query_cache
+from .embedding_service import embedding_service
+from .index_persistence import ExactVectors, IndexPersistence
 
-# Initialize embedding model 
-embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2", 
-                                            encode_kwargs={"normalize_embeddings": True}
-)
+# Target index type for every shard, see FAISS_INDEX_FACTORY and VECTOR_STORAGE
+INDEX_FACTORY = faiss_index.resolve_factory(settings.faiss_index_factory, settings.vector_storage)
+INDEX_METRIC = faiss_index.storage_metric(settings.vector_storage)
 
-# Initialize FAISS index 
-embedding_dim = len(embedding_model.embed_query("Hello world")) 
-index = faiss.IndexFlatL2(embedding_dim) 
+# Process roles, see INDEX_ROLE
+STANDALONE = "standalone"
+WRITER = "writer"
+READER = "reader"
+if settings.index_role not in (STANDALONE, WRITER, READER):
+    raise ValueError(f"Unsupported index role: {settings.index_role}")
+READ_ONLY = settings.index_role == READER
 
-vector_store = FAISS(
-    embedding_function=embedding_model, 
-    index=index, 
-    docstore=InMemoryDocstore(), 
-    index_to_docstore_id={}
-)
 
-# Chunking and adding documents to vector store 
-def add_docs_to_vector_store(docs: list[Document], 
-                             chunk_size: int = settings.chunk_size,
-                             chunk_overlap: int = settings.chunk_overlap):
-    """Split -> Embed -> Add to vector store"""
-    text_splitter = RecursiveCharacterTextSplitter(
+def _shard_dir(user_id: int) -> str:
+    return os.path.join(settings.index_dir, f"user_{user_id}")
+
+
+class UserIndex:
+    """One user's FAISS shard, persisted under INDEX_DIR/user_<id>
+
+    Every shard starts out as a flat index. Index types that need training
+    (IVF, PQ) are built in a background thread once the shard holds
+    INDEX_TRAIN_MIN_VECTORS and swapped in when ready; queries keep using
+    the old index in the meantime.
+
+    Quantized shards also keep the exact vectors (mapped from the snapshot)
+    so search results can be re-ranked without re-embedding anything.
+
+    Deleted chunks leave their vectors behind as tombstones, skipped at
+    search time. Once there are enough of them the same background rebuild
+    compacts the index without them.
+
+    In the reader role a shard is the last snapshot the writer published,
+    memory-mapped read-only; it is replaced when a newer one appears.
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.store = FAISS(
+            embedding_function=embedding_service, 
+            index=faiss_index.build_index(faiss_index.FLAT, embedding_service.dimension, INDEX_METRIC), 
+            docstore=InMemoryDocstore(), 
+            index_to_docstore_id={}
+        )
+        # Ingestion jobs run in worker threads, so writes to the shard are serialized
+        self.lock = threading.Lock()
+        # Index and docstore survive restarts through snapshots + a write-ahead log
+        self.read_only = READ_ONLY
+        # Readers always map snapshots, so every worker shares the same page cache
+        self.persistence = IndexPersistence(_shard_dir(user_id), 
+                                            mmap=settings.index_mmap or READ_ONLY, 
+                                            read_only=READ_ONLY, 
+                                            keep=0 if settings.index_role == STANDALONE 
+                                            else settings.index_keep_generations)
+        self.mmapped = self.persistence.load(self.store)
+        self.factory = self.persistence.meta.get("factory", faiss_index.FLAT)
+        self.metric = self.persistence.meta.get("metric", faiss_index.L2)
+        self.tombstones = self._find_tombstones()
+        self._exclude = faiss_index.exclude_ids(self.tombstones)
+        self.document_positions = self._find_document_positions()
+        self.rebuilding = False
+        self.pins = 0
+        self.last_used = time.monotonic()
+
+        if self.ntotal == 0:
+            # Shards with no training step get the configured index type right away
+            if not faiss_index.needs_training(INDEX_FACTORY, embedding_service.dimension, INDEX_METRIC):
+                self.store.index = faiss_index.build_index(INDEX_FACTORY, embedding_service.dimension, INDEX_METRIC)
+                self.factory = INDEX_FACTORY
+            else:
+                self.store.index = faiss_index.build_index(faiss_index.FLAT, embedding_service.dimension, INDEX_METRIC)
+                self.factory = faiss_index.FLAT
+            self.metric = INDEX_METRIC
+            self.mmapped = False
+        # Only quantized shards re-rank; None when the snapshot predates saving them
+        self.exact = self.persistence.vectors if faiss_index.is_lossy(self.factory) else None
+
+    @property
+    def ntotal(self) -> int:
+        return self.store.index.ntotal
+
+    @property
+    def generation(self) -> int:
+        return self.persistence.generation
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(f"Index of user {self.user_id} is read-only in the {READER} role")
+
+    def _find_tombstones(self) -> set[int]:
+        """Index positions whose document was deleted"""
+        docs = self.store.docstore._dict
+        return {position for position, doc_id in self.store.index_to_docstore_id.items() 
+                if doc_id not in docs}
+
+    def _find_document_positions(self) -> dict[int, list[int]]:
+        """Index positions of each document's chunks, for document-scoped searches"""
+        positions: dict[int, list[int]] = {}
+        docs = self.store.docstore._dict
+        for position, doc_id in self.store.index_to_docstore_id.items():
+            doc = docs.get(doc_id)
+            if doc is not None and doc.metadata.get("document_id") is not None:
+                positions.setdefault(doc.metadata["document_id"], []).append(position)
+        return positions
+
+    def _set_tombstones(self, tombstones: set[int]) -> None:
+        self.tombstones = tombstones
+        self._exclude = faiss_index.exclude_ids(tombstones)
+
+    def _meta(self) -> dict:
+        return {"factory": self.factory, "metric": self.metric}
+
+    def _snapshot(self) -> None:
+        """Snapshot the shard with its exact vectors (caller holds the lock)"""
+        self.persistence.snapshot(self.store, self._meta(), self.exact)
+        if self.exact is not None:
+            self.exact = self.persistence.vectors
+
+    def add(self, ids: list[str], texts: list[str], 
+            embeddings: list[list[float]], metadatas: list[dict]) -> None:
+        """Log a batch to the WAL, then add it to the index"""
+        self._check_writable()
+        with self.lock:
+            if self.mmapped:
+                self.mmapped = self.persistence.make_writable(self.store)
+
+            self.persistence.log_add(ids, texts, embeddings, metadatas)
+            start = self.ntotal
+            self.store.add_embeddings(zip(texts, embeddings), metadatas=metadatas, ids=ids)
+            if self.exact is not None:
+                self.exact.append(embeddings)
+            for position, metadata in enumerate(metadatas, start):
+                if metadata.get("document_id") is not None:
+                    self.document_positions.setdefault(metadata["document_id"], []).append(position)
+            query_cache.invalidate_user(self.user_id)
+
+            if self.persistence.wal_size > settings.index_wal_max_bytes:
+                self._snapshot()
+
+    def delete(self, ids: list[str]) -> int:
+        """Log the deletion to the WAL, then tombstone the chunks; returns how many existed"""
+        self._check_writable()
+        with self.lock:
+            ids = [doc_id for doc_id in ids if doc_id in self.store.docstore._dict]
+            if not ids:
+                return 0
+
+            self.persistence.log_delete(ids)
+            self.persistence.apply(self.store, {"op": "delete", "ids": ids})
+            deleted = set(ids)
+            self._set_tombstones(self.tombstones | {
+                position for position, doc_id in self.store.index_to_docstore_id.items() 
+                if doc_id in deleted
+            })
+            query_cache.invalidate_user(self.user_id)
+
+            if self.persistence.wal_size > settings.index_wal_max_bytes:
+                self._snapshot()
+            return len(ids)
+
+    def find_ids(self, **metadata) -> list[str]:
+        """Ids of the live chunks whose metadata has all the given values"""
+        with self.lock:
+            return [doc_id for doc_id, doc in self.store.docstore._dict.items() 
+                    if all(doc.metadata.get(key) == value for key, value in metadata.items())]
+
+    def _needs_upgrade(self) -> bool:
+        if (self.factory, self.metric) == (INDEX_FACTORY, INDEX_METRIC):
+            return False
+        # A metric change can't wait for the training threshold, scores would be mixed up
+        return self.metric != INDEX_METRIC or \
+            self.ntotal - len(self.tombstones) >= settings.index_train_min_vectors
+
+    def _needs_compaction(self) -> bool:
+        return len(self.tombstones) >= settings.index_compact_min_tombstones and \
+            len(self.tombstones) >= settings.index_compact_ratio * self.ntotal
+
+    def should_rebuild(self) -> bool:
+        return not self.read_only and not self.rebuilding and \
+            (self._needs_upgrade() or self._needs_compaction())
+
+    def rebuild(self) -> None:
+        """Build the configured index type from the live vectors and swap it in
+
+        Also how tombstones are compacted away: only live positions are copied.
+        """
+        with self.lock:
+            factory, metric = (INDEX_FACTORY, INDEX_METRIC) if self._needs_upgrade() \
+                else (self.factory, self.metric)
+            count = self.ntotal
+            live = [position for position in range(count) if position not in self.tombstones]
+            ids = [self.store.index_to_docstore_id[position] for position in live]
+            # Train on the exact vectors when the shard has them (flat indexes are exact anyway)
+            exact = self.exact is not None or not faiss_index.is_lossy(self.factory)
+            vectors = self._vectors(live) if self.exact is not None \
+                else faiss_index.reconstruct(self.store.index, 0, count)[live]
+
+        # Too few vectors to train on (yet, or after deletes), use a flat index for now
+        if len(live) < settings.index_train_min_vectors \
+                and faiss_index.needs_training(factory, embedding_service.dimension, metric):
+            factory = faiss_index.FLAT
+
+        # Training runs without the lock so queries and writes carry on
+        new_index = faiss_index.train_and_fill(factory, metric, vectors, settings.index_train_max_samples)
+
+        with self.lock:
+            # Catch up on vectors added while training
+            added = self.ntotal - count
+            added_vectors = self._vectors(range(count, count + added)) if self.exact is not None \
+                else faiss_index.reconstruct(self.store.index, count, added)
+            if added > 0:
+                new_index.add(added_vectors)
+                ids.extend(self.store.index_to_docstore_id[position] for position in range(count, count + added))
+            self.store.index = new_index
+            self.exact = None
+            if exact and faiss_index.is_lossy(factory):
+                self.exact = ExactVectors(embedding_service.dimension)
+                self.exact.append(vectors)
+                self.exact.append(added_vectors)
+            self.store.index_to_docstore_id = dict(enumerate(ids))
+            # Chunks deleted while training are tombstones in the new index
+            self._set_tombstones(self._find_tombstones())
+            self.document_positions = self._find_document_positions()
+            self.factory = factory
+            self.metric = metric
+            self.mmapped = False
+            query_cache.invalidate_user(self.user_id)
+            self._snapshot()
+        print(f"Rebuilt index for user {self.user_id} as {factory}/{metric} "
+              f"({new_index.ntotal} vectors, {count - len(live)} tombstones dropped)")
+
+    def _vectors(self, positions: Iterable[int]) -> np.ndarray:
+        return self.exact.get(list(positions))
+
+    def _scope(self, document_ids: Iterable[int]) -> list[int]:
+        """Live positions of the given documents' chunks"""
+        return [position for document_id in document_ids 
+                for position in self.document_positions.get(document_id, ()) 
+                if position not in self.tombstones]
+
+    def search_by_vector(self, query_embedding: list[float], k: int, 
+                         nprobe: Optional[int] = None, 
+                         ef_search: Optional[int] = None,
+                         document_ids: Optional[Iterable[int]] = None) -> list[Document]:
+        """k nearest chunks, only among the given documents' when document_ids is set"""
+        embedding = np.asarray([query_embedding], dtype=np.float32)
+
+        # FAISS does not allow searching while vectors are being appended
+        with self.lock:
+            if self.ntotal == 0:
+                return []
+            # Quantized codes are over-fetched, then re-ranked on the exact vectors
+            rerank = self.exact is not None and settings.vector_rerank_factor > 1
+            fetch_k = k * settings.vector_rerank_factor if rerank else k
+            positions = self._search_positions(embedding, fetch_k, nprobe, ef_search, document_ids)
+
+            docs, found = [], []
+            for position in positions:
+                if position == -1:
+                    continue
+                doc = self.store.docstore.search(self.store.index_to_docstore_id[position])
+                if isinstance(doc, Document):
+                    docs.append(doc)
+                    found.append(position)
+            vectors = self._vectors(found) if rerank and len(docs) > k else None
+
+        if vectors is not None:
+            docs = [docs[i] for i in faiss_index.nearest(vectors, self.metric, embedding[0], k)]
+        return docs[:k]
+
+    def _search_positions(self, embedding: np.ndarray, k: int, 
+                          nprobe: Optional[int], ef_search: Optional[int], 
+                          document_ids: Optional[Iterable[int]]) -> np.ndarray:
+        """Positions of the nearest vectors (caller holds the lock)"""
+        index = self.store.index
+        selector = self._exclude
+        if document_ids is not None:
+            scope = self._scope(document_ids)
+            if len(scope) <= settings.scoped_search_exact_max:
+                with metrics.timed("faiss_search"):
+                    return faiss_index.exact_search(index, self.metric, embedding[0], scope, k)
+            # Filtered inside the index; the scope already leaves out tombstones
+            selector = faiss_index.include_ids(scope)
+
+        params = faiss_index.search_params(index, 
+                                           nprobe or settings.faiss_nprobe, 
+                                           ef_search or settings.faiss_ef_search, 
+                                           selector=selector)
+        with metrics.timed("faiss_search"):
+            _, positions = index.search(embedding, k, params=params)
+        return positions[0]
+
+    def publish(self) -> None:
+        """Snapshot the writes logged since the last snapshot, making them visible to readers"""
+        with self.lock:
+            if not self.read_only and self.persistence.wal_size:
+                self._snapshot()
+
+    def close(self) -> None:
+        """Write a final snapshot and release the WAL"""
+        self.publish()
+        with self.lock:
+            self.persistence.close()
+
+
+# Loaded shards, least recently used first; _shards_lock only guards this bookkeeping
+_shards: "OrderedDict[int, UserIndex]" = OrderedDict()
+_shards_lock = threading.Lock()
+
+# Per-user locks a shard is loaded and closed under, with how many threads are using each
+_user_locks: dict[int, tuple[threading.Lock, int]] = {}
+
+
+def _enter_user(user_id: int) -> threading.Lock:
+    """A user's load/close lock, kept until the matching _leave_user (caller holds _shards_lock)"""
+    lock, users = _user_locks.get(user_id) or (threading.Lock(), 0)
+    _user_locks[user_id] = (lock, users + 1)
+    return lock
+
+
+def _leave_user(user_id: int) -> None:
+    """(caller holds _shards_lock)"""
+    lock, users = _user_locks[user_id]
+    if users == 1:
+        del _user_locks[user_id]
+    else:
+        _user_locks[user_id] = (lock, users - 1)
+
+
+def _evict_shards() -> None:
+    """Unload idle shards and trim to INDEX_MAX_LOADED_SHARDS
+
+    Shards are taken out of _shards under the global lock but closed (a
+    final snapshot) under their user's lock only, so a load of that user
+    waits for it and nobody else does.
+    """
+    evicted = []
+    idle_before = time.monotonic() - settings.index_shard_idle_seconds
+    with _shards_lock:
+        for user_id, shard in list(_shards.items()):
+            over_limit = len(_shards) > settings.index_max_loaded_shards
+            # Users being loaded or closed right now are left alone
+            if shard.pins == 0 and user_id not in _user_locks and \
+                    (over_limit or shard.last_used < idle_before):
+                del _shards[user_id]
+                lock = _enter_user(user_id)
+                lock.acquire()
+                evicted.append((shard, lock))
+
+    for shard, lock in evicted:
+        try:
+            shard.close()
+        except Exception as e:
+            print(f"Closing index of user {shard.user_id} failed: {e}")
+        finally:
+            lock.release()
+            with _shards_lock:
+                _leave_user(shard.user_id)
+
+
+# Reader role: generation in each shard's CURRENT file when last read, and when that was
+_published: dict[int, tuple[int, float]] = {}
+_published_lock = threading.Lock()
+
+
+def published_generation(user_id: int) -> int:
+    """Latest snapshot the writer published for a user, re-read at most every INDEX_RELOAD_INTERVAL_SECONDS
+
+    A new generation drops the user's cached results right away; the shard
+    itself is swapped on its next use.
+    """
+    now = time.monotonic()
+    with _published_lock:
+        seen = _published.get(user_id)
+        if seen is not None and now - seen[1] < settings.index_reload_interval_seconds:
+            return seen[0]
+        generation = IndexPersistence.read_generation(_shard_dir(user_id))
+        _published[user_id] = (generation, now)
+    if seen is not None and seen[0] != generation:
+        query_cache.invalidate_user(user_id)
+    return generation
+
+
+def _pin_loaded(user_id: int, generation: int) -> Optional[UserIndex]:
+    """Pin the user's loaded shard if it is current (caller holds _shards_lock)"""
+    shard = _shards.get(user_id)
+    if shard is not None and shard.generation < generation:
+        # Searches already holding the old shard finish on it, it is freed after them
+        del _shards[user_id]
+        return None
+    if shard is not None:
+        _shards.move_to_end(user_id)
+        shard.pins += 1
+        shard.last_used = time.monotonic()
+    return shard
+
+
+@contextmanager
+def user_index(user_id: int) -> Iterator[UserIndex]:
+    """Pin a user's shard for the duration of the block, loading it on first use
+
+    A cold load runs under the user's own lock, so it only holds up
+    requests for that user.
+    """
+    # Readers swap in the writer's latest snapshot
+    generation = published_generation(user_id) if READ_ONLY else 0
+    loaded = False
+    with _shards_lock:
+        shard = _pin_loaded(user_id, generation)
+        lock = _enter_user(user_id) if shard is None else None
+
+    if lock is not None:
+        try:
+            with lock:
+                # Loaded by another request while this one waited
+                with _shards_lock:
+                    shard = _pin_loaded(user_id, generation)
+                if shard is None:
+                    shard = UserIndex(user_id)
+                    loaded = True
+                    shard.pins = 1
+                    with _shards_lock:
+                        _shards[user_id] = shard
+        finally:
+            with _shards_lock:
+                _leave_user(user_id)
+
+    _evict_shards()
+    if loaded and shard.should_rebuild():
+        _rebuild_in_background(shard)
+    try:
+        yield shard
+    finally:
+        with _shards_lock:
+            shard.pins -= 1
+            shard.last_used = time.monotonic()
+
+
+def _rebuild_in_background(shard: UserIndex) -> None:
+    """Train the configured index type for a shard without blocking queries"""
+    with _shards_lock:
+        if shard.rebuilding:
+            return
+        shard.rebuilding = True
+        # Keep the shard loaded until the new index is swapped in
+        shard.pins += 1
+
+    def run():
+        try:
+            shard.rebuild()
+        except Exception as e:
+            print(f"Index rebuild failed for user {shard.user_id}: {e}")
+        finally:
+            with _shards_lock:
+                shard.rebuilding = False
+                shard.pins -= 1
+
+    threading.Thread(target=run, name=f"index-rebuild-{shard.user_id}", daemon=True).start()
+
+
+def _query_embedding(query: str) -> list[float]:
+    vector = query_cache.get_query_vector(query)
+    if vector is None:
+        with metrics.timed("query_embed"):
+            vector = embedding_service.embed_query(query)
+        query_cache.put_query_vector(query, vector)
+    return vector
+
+
+async def _aquery_embedding(query: str) -> list[float]:
+    vector = query_cache.get_query_vector(query)
+    if vector is None:
+        # The query joins the next embedding micro-batch
+        with metrics.timed("query_embed"):
+            vector = await embedding_service.aembed_query(query)
+        query_cache.put_query_vector(query, vector)
+    return vector
+
+
+def _search(user_id: int, query_embedding: list[float], k: int, 
+            nprobe: Optional[int], ef_search: Optional[int], 
+            document_ids: Optional[tuple[int, ...]] = None) -> list[Document]:
+    with user_index(user_id) as shard:
+        return shard.search_by_vector(query_embedding, k, nprobe=nprobe, ef_search=ef_search, 
+                                      document_ids=document_ids)
+
+
+def _scope_key(document_ids: Optional[Iterable[int]]) -> Optional[tuple[int, ...]]:
+    return tuple(sorted(set(document_ids))) if document_ids is not None else None
+
+
+def similarity_search(user_id: int, query: str, k: int = 4, 
+                      nprobe: Optional[int] = None, 
+                      ef_search: Optional[int] = None,
+                      document_ids: Optional[Iterable[int]] = None) -> list[Document]:
+    """Search only the given user's documents, or only some of them"""
+    if READ_ONLY:
+        published_generation(user_id)
+    scope = _scope_key(document_ids)
+    key = query_cache.results_key(user_id, query, k, nprobe, ef_search, scope)
+    docs = query_cache.get_results(key)
+    if docs is None:
+        docs = _search(user_id, _query_embedding(query), k, nprobe, ef_search, scope)
+        query_cache.put_results(key, docs)
+    return docs
+
+
+async def asimilarity_search(user_id: int, query: str, k: int = 4, 
+                             nprobe: Optional[int] = None, 
+                             ef_search: Optional[int] = None,
+                             document_ids: Optional[Iterable[int]] = None) -> list[Document]:
+    """Async search: embedding is micro-batched and FAISS runs on the search executor"""
+    if READ_ONLY:
+        published_generation(user_id)
+    scope = _scope_key(document_ids)
+    key = query_cache.results_key(user_id, query, k, nprobe, ef_search, scope)
+    docs = query_cache.get_results(key)
+    if docs is None:
+        executors.search.check_capacity()
+        query_embedding = await _aquery_embedding(query)
+        docs = await executors.search.run(_search, user_id, query_embedding, k, nprobe, ef_search, scope)
+        query_cache.put_results(key, docs)
+    return docs
+
+
+def delete_chunks(user_id: int, ids: list[str]) -> int:
+    """Remove chunks from a user's shard, compacting in the background once tombstones pile up"""
+    with user_index(user_id) as shard:
+        deleted = shard.delete(ids)
+        if shard.should_rebuild():
+            _rebuild_in_background(shard)
+    return deleted
+
+
+def find_chunk_ids(user_id: int, **metadata) -> list[str]:
+    with user_index(user_id) as shard:
+        return shard.find_ids(**metadata)
+
+
+def publish(user_id: int) -> None:
+    """Writer role: snapshot a user's shard so readers see its latest writes"""
+    with user_index(user_id) as shard:
+        shard.publish()
+
+
+def close_vector_store() -> None:
+    """Snapshot and unload every loaded shard"""
+    with _shards_lock:
+        shards = list(_shards.values())
+        _shards.clear()
+    for shard in shards:
+        shard.close()
+
+
+# Called with (stage, count) as chunks move through the pipeline
+ProgressCallback = Optional[Callable[[str, int], None]]
+
+
+def _text_splitter(chunk_size: int, chunk_overlap: int):
+    # Imported on first use: the package imports sentence-transformers (and torch) when installed
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         separators=["\n\n", "\n", " ", ""], 
         add_start_index=True
     )
-    all_splits = text_splitter.split_documents(docs) 
+
+
+def split_documents(docs: list[Document], 
+                    chunk_size: int = settings.chunk_size,
+                    chunk_overlap: int = settings.chunk_overlap) -> list[Document]:
+    """Split documents into overlapping chunks"""
+    return _text_splitter(chunk_size, chunk_overlap).split_documents(docs) 
+
+
+def iter_chunks(docs: Iterable[Document], 
+                chunk_size: int = settings.chunk_size,
+                chunk_overlap: int = settings.chunk_overlap) -> Iterator[Document]:
+    """Split pages one at a time as they arrive"""
+    text_splitter = _text_splitter(chunk_size, chunk_overlap)
+    for doc in docs:
+        # Blocks of a larger text carry their offset in it
+        offset = doc.metadata.pop("offset", 0)
+        with metrics.timed("split"):
+            chunks = text_splitter.split_documents([doc])
+        for chunk in chunks:
+            chunk.metadata["start_index"] += offset
+            yield chunk
+
+
+def _index_batch(shard: UserIndex, batch: list[Document], 
+                 on_progress: ProgressCallback) -> list[str]:
+    """Embed one batch of chunks and add it to the shard"""
+    metrics.CHUNKS.labels("split").inc(len(batch))
+    if on_progress:
+        on_progress("split", len(batch))
+
     try: 
-        doc_ids = vector_store.add_documents(all_splits) 
+        texts = [doc.page_content for doc in batch]
+        with metrics.timed("embed"):
+            embeddings = embedding_service.embed_documents(texts)
+        metrics.CHUNKS.labels("embedded").inc(len(batch))
+        if on_progress:
+            on_progress("embedded", len(batch))
+
+        ids = [str(uuid.uuid4()) for _ in batch]
+        with metrics.timed("index_add"):
+            shard.add(ids, texts, embeddings, [doc.metadata for doc in batch])
     except Exception as e: 
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
                             detail=f"Error with Vector Store: {str(e)}")
-    return doc_ids 
+    metrics.CHUNKS.labels("indexed").inc(len(batch))
+    if on_progress:
+        on_progress("indexed", len(batch))
+    return ids
 
+
+# Chunking and adding documents to vector store 
+def add_docs_to_vector_store(docs: Iterable[Document], 
+                             user_id: int,
+                             chunk_size: int = settings.chunk_size,
+                             chunk_overlap: int = settings.chunk_overlap,
+                             batch_size: int = settings.embedding_batch_size,
+                             on_progress: ProgressCallback = None,
+                             metadata: Optional[dict] = None):
+    """Split -> Embed -> Add to vector store, streaming
+
+    docs may be a generator: pages are split as they arrive and chunks are
+    embedded and indexed every batch_size, so memory doesn't grow with the
+    document. metadata (e.g. the document id) is stamped on every chunk.
+    """
+    doc_ids = []
+    with user_index(user_id) as shard:
+        batch = []
+        for chunk in iter_chunks(docs, chunk_size, chunk_overlap):
+            if metadata:
+                chunk.metadata.update(metadata)
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                doc_ids.extend(_index_batch(shard, batch, on_progress))
+                batch = []
+        if batch:
+            doc_ids.extend(_index_batch(shard, batch, on_progress))
+
+        if shard.should_rebuild():
+            _rebuild_in_background(shard)
+    return doc_ids 
@@ -1,4 +1,5 @@
 from passlib.context import CryptContext
+from .services import executors
 
 # Create a password hashing context using the "bcrypt" algorithm.
 # "deprecated='auto'" tells passlib to automatically mark old or weak schemes as deprecated.
@@ -16,4 +17,12 @@ def hash(password: str):
     return pwd_context.hash(password)
 
 def verify(plain_password, hashed_password): 
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+# bcrypt is deliberately slow (~100-250 ms), so the event loop hands it to the auth pool
+async def hash_async(password: str): 
+    return await executors.auth.run(hash, password)
+
+async def verify_async(plain_password, hashed_password): 
+    return await executors.auth.run(verify, plain_password, hashed_password)
@@ -0,0 +1,130 @@
+"""Throughput and similarity drift of the embedding backends
+
+Embeds the same texts with each EMBEDDING_BACKEND and compares them against
+the torch backend, which is what existing indexes were built with:
+
+    python -m benchmarks.embeddings --backends torch,onnx,int8 --texts 512
+    python -m benchmarks.embeddings --threads 4 --batch-size 64 --output embeddings.json
+
+Drift is the cosine similarity of each text's vector to its torch vector, and
+the overlap of nearest-neighbour results (recall@k) when queries and corpus
+are both embedded with the candidate backend. Texts are synthetic unless
+--corpus points to a file with one text per line. The onnx backend needs
+`pip install "optimum[onnxruntime]"`.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from .environment import PLACEHOLDER_ENV
+from .pipeline import git_commit, synthetic_text
+
+
+def load_texts(args) -> list[str]:
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        return texts[:args.texts]
+    rng = random.Random(args.seed)
+    return [synthetic_text(rng, rng.randint(40, 160)) for _ in range(args.texts)]
+
+
+def top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def benchmark(backend: str, texts: list[str], queries: list[str], repeats: int) -> tuple[dict, np.ndarray, np.ndarray]:
+    from app.services.embedding_service import load_embedding_model
+
+    start = time.perf_counter()
+    model, _ = load_embedding_model(backend)
+    load_seconds = time.perf_counter() - start
+    model.embed_documents(texts[:8])
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        vectors = model.embed_documents(texts)
+    batch_seconds = (time.perf_counter() - start) / repeats
+
+    # Single-query latency, as the chat path sees it
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.embed_documents([query])
+        latencies.append(time.perf_counter() - start)
+
+    row = {
+        "backend": backend,
+        "load_s": load_seconds,
+        "texts_per_s": len(texts) / batch_seconds,
+        "query_p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "query_p99_ms": 1000 * float(np.percentile(latencies, 99)),
+    }
+    return row, np.asarray(vectors, dtype=np.float32), np.asarray(model.embed_documents(queries), dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=lambda s: s.split(","), default=["torch", "onnx", "int8"])
+    parser.add_argument("--texts", type=int, default=512, help="corpus size")
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=2, help="timed passes over the corpus")
+    parser.add_argument("--threads", type=int, help="EMBEDDING_THREADS")
+    parser.add_argument("--batch-size", type=int, help="EMBEDDING_ENCODE_BATCH_SIZE")
+    parser.add_argument("--corpus", help="text file, one text per line")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if not os.path.exists(".env"):
+        for name, value in PLACEHOLDER_ENV.items():
+            os.environ.setdefault(name, value)
+    if args.threads:
+        os.environ["EMBEDDING_THREADS"] = str(args.threads)
+    if args.batch_size:
+        os.environ["EMBEDDING_ENCODE_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "false"
+
+    texts = load_texts(args)
+    rng = random.Random(args.seed + 1)
+    queries = [synthetic_text(rng, rng.randint(4, 12)) for _ in range(args.queries)]
+
+    # The reference runs first even when not listed, drift is measured against it
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    results = []
+    reference = None
+    for backend in backends:
+        row, vectors, query_vectors = benchmark(backend, texts, queries, args.repeats)
+        if reference is None:
+            reference = (row, vectors, query_vectors, top_k(vectors, query_vectors, args.k))
+        ref_row, ref_vectors, _, ref_neighbours = reference
+
+        cosine = np.sum(vectors * ref_vectors, axis=1)
+        neighbours = top_k(vectors, query_vectors, args.k)
+        row.update({
+            "speedup_vs_torch": row["texts_per_s"] / ref_row["texts_per_s"],
+            "cosine_to_torch_mean": float(cosine.mean()),
+            "cosine_to_torch_min": float(cosine.min()),
+            f"recall@{args.k}_vs_torch": float(np.mean([len(set(a) & set(b)) / args.k
+                                                        for a, b in zip(neighbours, ref_neighbours)])),
+        })
+        if backend in args.backends:
+            results.append(row)
+
+    for row in results:
+        print(f"{row['backend']:>6}: {row['texts_per_s']:8.1f} texts/s ({row['speedup_vs_torch']:.2f}x), "
+              f"query p50 {row['query_p50_ms']:.1f} ms, cosine to torch {row['cosine_to_torch_mean']:.4f} "
+              f"(min {row['cosine_to_torch_min']:.4f}), recall@{args.k} {row[f'recall@{args.k}_vs_torch']:.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+"""Placeholder settings for benchmarks, kept free of heavy imports"""
+
+# Settings without defaults, used when there is no .env; only CHUNK_* and
+# POPPLER_PATH (empty: poppler from PATH) matter to the benchmarks
+PLACEHOLDER_ENV = {
+    "DATABASE_USERNAME": "benchmark",
+    "DATABASE_PASSWORD": "benchmark",
+    "DATABASE_PORT": "5432",
+    "DATABASE_HOST": "localhost",
+    "DATABASE_NAME": "benchmark",
+    "SECRET_KEY": "benchmark",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "GEMINI_API_KEY": "benchmark",
+    "CHUNK_SIZE": "1000",
+    "CHUNK_OVERLAP": "200",
+    "POPPLER_PATH": "",
+}
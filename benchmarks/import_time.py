@@ -0,0 +1,90 @@
+"""Import-time budget for the API process
+
+Imports app.main in a fresh interpreter and fails (exit code 1) when it takes
+longer than --budget seconds or pulls in a module that must stay lazy
+(ML runtimes, the chat model client). Run it in CI or before a release:
+
+    python -m benchmarks.import_time --budget 6
+    python -m benchmarks.import_time --top 20 --output import_time.json
+
+The slowest modules are listed from `python -X importtime`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from .environment import PLACEHOLDER_ENV
+
+
+# Seconds `import app.main` may take, also enforced by tests/test_import_time.py
+BUDGET_SECONDS = 6.0
+
+# Loaded by the model loaders and warm-up, never by importing the app
+LAZY_MODULES = ("torch", "transformers", "sentence_transformers", "langchain_google_genai", "sympy", "grpc")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def slowest(importtime_log: str, top: int) -> list[dict]:
+    """Packages by cumulative import time, counted where they were first imported"""
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        name = name.strip()
+        if "." not in name and name != "app":
+            rows.append({"module": name, "seconds": int(cumulative) / 1e6})
+    return sorted(rows, key=lambda row: -row["seconds"])[:top]
+
+
+def measure() -> tuple[dict, str]:
+    env = dict(os.environ)
+    if not os.path.exists(".env"):
+        for name, value in PLACEHOLDER_ENV.items():
+            env.setdefault(name, value)
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD % (LAZY_MODULES,)],
+                           env=env, capture_output=True, text=True)
+    if child.returncode != 0:
+        sys.exit(f"Importing app.main failed:\n{child.stderr[-2000:]}")
+    return json.loads(child.stdout.strip().splitlines()[-1]), child.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=BUDGET_SECONDS, help="seconds allowed for `import app.main`")
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest imports to list")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    result, log = measure()
+    result["slowest"] = slowest(log, args.top)
+    result["budget"] = args.budget
+
+    print(f"import app.main: {result['seconds']:.2f} s (budget {args.budget:.2f} s)")
+    for row in result["slowest"]:
+        print(f"  {row['seconds']:6.2f} s  {row['module']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    failures = []
+    if result["seconds"] > args.budget:
+        failures.append(f"over budget by {result['seconds'] - args.budget:.2f} s")
+    if result["loaded"]:
+        failures.append(f"imported eagerly: {', '.join(result['loaded'])}")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""End-to-end ingestion and retrieval throughput at increasing corpus sizes
+
+Generates synthetic PDFs (with a text layer, or image-only pages that have to
+go through OCR), ingests them with load_documents and add_docs_to_vector_store,
+and measures vector_store.similarity_search latency after each size step.
+
+    python -m benchmarks.pipeline --sizes 10,50,200 --pages 5
+    python -m benchmarks.pipeline --image-every 4 --output results/pipeline.json
+
+Embeddings come from the deterministic fake backend (EMBEDDING_BACKEND=fake)
+so runs are offline and repeatable; --real-embeddings uses the configured
+model instead. The index and embedding cache live in a temporary directory.
+Without a .env, settings that have no default (database, JWT, API key) get
+placeholders; nothing here connects to them.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import time
+
+import fitz
+import numpy as np
+
+from .environment import PLACEHOLDER_ENV
+
+
+WORDS = (
+    "contract clause party payment term notice period agreement liability invoice "
+    "delivery service warranty breach damages schedule annex obligation renewal "
+    "termination fee report revenue quarter growth margin forecast customer product "
+    "market risk policy compliance audit data privacy security access control system "
+    "network storage backup recovery incident response training employee manager"
+).split()
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def write_pdf(path: str, rng: random.Random, pages: int, words_per_page: int, image_only: bool) -> None:
+    """A PDF of generated prose; image-only pages are rasterized so they have no text layer"""
+    with fitz.open() as doc:
+        for _ in range(pages):
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (50, 50, -50, -50), synthetic_text(rng, words_per_page), fontsize=10)
+            if image_only:
+                pixmap = page.get_pixmap(dpi=150)
+                rect = page.rect
+                doc.delete_page(-1)
+                doc.new_page(width=rect.width, height=rect.height).insert_image(rect, pixmap=pixmap)
+        doc.save(path)
+
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in KiB on Linux; OCR runs in child processes
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def configure(args, workdir: str) -> None:
+    """Point the app at the scratch directory; must run before app modules are imported"""
+    if not os.path.exists(".env"):
+        for name, value in PLACEHOLDER_ENV.items():
+            os.environ.setdefault(name, value)
+    if not args.real_embeddings:
+        os.environ["EMBEDDING_BACKEND"] = "fake"
+    os.environ["INDEX_DIR"] = os.path.join(workdir, "index")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embeddings.sqlite3")
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "true" if args.embedding_cache else "false"
+
+
+def run(args, workdir: str) -> list[dict]:
+    from app.services import executors
+    from app.services.document_processor import load_documents
+    from app.services.embedding_service import embedding_service
+    from app.services.vector_store import (add_docs_to_vector_store, close_vector_store, 
+                                           similarity_search, split_documents)
+
+    # Models and lazily imported packages load before the clock starts
+    embedding_service.warm_up()
+    split_documents([])
+
+    rng = random.Random(args.seed)
+    user_id = 1
+    ingested = 0
+    results = []
+    try:
+        for size in args.sizes:
+            pages = chunks = 0
+            load_seconds = index_seconds = 0.0
+            for i in range(ingested, size):
+                path = os.path.join(workdir, f"doc_{i}.pdf")
+                image_only = args.image_every > 0 and i % args.image_every == args.image_every - 1
+                write_pdf(path, rng, args.pages, args.words_per_page, image_only)
+
+                start = time.perf_counter()
+                docs = load_documents(path)
+                load_seconds += time.perf_counter() - start
+                pages += len(docs)
+
+                start = time.perf_counter()
+                chunks += len(add_docs_to_vector_store(docs, user_id))
+                index_seconds += time.perf_counter() - start
+            ingested = size
+
+            # Fresh query texts each time, so neither query cache can answer
+            latencies = []
+            for _ in range(args.queries):
+                query = synthetic_text(rng, rng.randint(4, 12))
+                start = time.perf_counter()
+                similarity_search(user_id, query, k=args.k)
+                latencies.append(time.perf_counter() - start)
+
+            results.append({
+                "documents": size,
+                "new_pages": pages,
+                "new_chunks": chunks,
+                "pages_per_s": pages / load_seconds if load_seconds else None,
+                "chunks_per_s": chunks / index_seconds if index_seconds else None,
+                "search_p50_ms": 1000 * float(np.percentile(latencies, 50)),
+                "search_p99_ms": 1000 * float(np.percentile(latencies, 99)),
+                "peak_rss_mb": peak_rss_mb(),
+            })
+    finally:
+        close_vector_store()
+        executors.shutdown()
+        embedding_service.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=lambda s: sorted(int(n) for n in s.split(",")), default=[10, 50, 200],
+                        help="comma-separated corpus sizes in documents, ingested cumulatively")
+    parser.add_argument("--pages", type=int, default=5, help="pages per document")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--image-every", type=int, default=0,
+                        help="make every Nth document image-only, exercising OCR (needs poppler and tesseract)")
+    parser.add_argument("--queries", type=int, default=200, help="searches per size step")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real-embeddings", action="store_true", help="use the configured embedding model")
+    parser.add_argument("--embedding-cache", action="store_true", help="keep the chunk-embedding cache enabled")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="askpdf-bench-") as workdir:
+        configure(args, workdir)
+        results = run(args, workdir)
+
+    for row in results:
+        print(f"{row['documents']:>6} docs: {row['pages_per_s'] or 0:8.1f} pages/s, "
+              f"{row['chunks_per_s'] or 0:8.1f} chunks/s, "
+              f"search p50 {row['search_p50_ms']:.2f} ms / p99 {row['search_p99_ms']:.2f} ms, "
+              f"peak RSS {row['peak_rss_mb']['self']:.0f} MB")
+
+    if args.output:
+        if os.path.dirname(args.output):
+            os.makedirs(os.path.dirname(args.output), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Index memory and recall@k of the vector storage modes
+
+Compares the current float32 IndexFlatL2 against inner-product search on
+fp16 / int8 scalar-quantized vectors, with and without the exact re-rank
+of over-fetched candidates that VECTOR_RERANK_FACTOR enables.
+
+    python -m benchmarks.quantization --vectors 50000 --dim 768
+    python -m benchmarks.quantization --embeddings chunks.npy --output results.json
+
+Vectors are synthetic (normalized, clustered) unless --embeddings points to
+a .npy file of real chunk embeddings.
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from app.services import faiss_index
+
+
+def synthetic_embeddings(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Normalized vectors grouped around random centers, loosely like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(f[:k]) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, rerank_factor: int) -> list[dict]:
+    dim = vectors.shape[1]
+
+    # Ground truth and baseline: what vector_store.py stores today
+    baseline = faiss.IndexFlatL2(dim)
+    baseline.add(vectors)
+    _, truth = baseline.search(queries, k)
+
+    results = []
+    for storage in ("float32", "fp16", "int8"):
+        factory = faiss_index.resolve_factory(faiss_index.FLAT, storage)
+        metric = faiss_index.storage_metric(storage)
+        index = faiss_index.train_and_fill(factory, metric, vectors, max_train_samples=100_000)
+        memory = len(faiss.serialize_index(index))
+
+        rerank_options = [1]
+        if faiss_index.is_lossy(factory) and rerank_factor > 1:
+            rerank_options.append(rerank_factor)
+
+        for factor in rerank_options:
+            start = time.perf_counter()
+            _, found = index.search(queries, k * factor)
+            if factor > 1:
+                # Exact inner product on the candidates, as UserIndex re-ranks them
+                for row, candidates in enumerate(found):
+                    candidates = candidates[candidates >= 0]
+                    scores = vectors[candidates] @ queries[row]
+                    ranked = candidates[np.argsort(-scores)]
+                    found[row, :len(ranked)] = ranked
+            elapsed = time.perf_counter() - start
+
+            results.append({
+                "storage": storage,
+                "factory": factory,
+                "metric": metric,
+                "rerank_factor": factor,
+                "index_bytes": memory,
+                "bytes_per_vector": memory / len(vectors),
+                "memory_vs_float32": memory / len(faiss.serialize_index(baseline)),
+                f"recall@{k}": recall_at_k(found[:, :k], truth),
+                "query_ms": 1000 * elapsed / len(queries),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=3)
+    parser.add_argument("--embeddings", help=".npy file of normalized embeddings to use instead of synthetic ones")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+    else:
+        vectors = synthetic_embeddings(args.vectors + args.queries, args.dim)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+
+    results = run(vectors, queries, args.k, args.rerank_factor)
+    for row in results:
+        print(f"{row['storage']:>8} rerank x{row['rerank_factor']}: "
+              f"{row['bytes_per_vector']:8.1f} B/vector ({row['memory_vs_float32']:.2f}x), "
+              f"recall@{args.k} {row[f'recall@{args.k}']:.3f}, {row['query_ms']:.2f} ms/query")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "dim": vectors.shape[1], "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""unique document content hash per user
+
+Revision ID: c4b9e2d7f1a3
+Revises: 7a1e5d0c2b8f
+Create Date: 2026-10-18 19:06:27.841530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4b9e2d7f1a3'
+down_revision: Union[str, Sequence[str], None] = '7a1e5d0c2b8f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Duplicates from concurrent uploads keep their rows but stop counting as the content's document
+    op.execute(
+        "UPDATE documents SET content_hash = NULL "
+        "WHERE content_hash IS NOT NULL AND id NOT IN ("
+        "SELECT min(id) FROM documents WHERE content_hash IS NOT NULL GROUP BY user_id, content_hash)"
+    )
+    op.create_index('uq_documents_user_id_content_hash', 'documents', ['user_id', 'content_hash'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_documents_user_id_content_hash', table_name='documents')
@@ -0,0 +1,24 @@
+"""Import-time budget of the API process, see benchmarks/import_time.py"""
+from pathlib import Path
+
+import pytest
+
+from benchmarks import import_time
+
+
+@pytest.fixture(scope="module")
+def result() -> dict:
+    # The child interpreter imports app.main from the repository root
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(Path(__file__).resolve().parents[1])
+        measured, _ = import_time.measure()
+    return measured
+
+
+def test_import_within_budget(result):
+    assert result["seconds"] <= import_time.BUDGET_SECONDS, \
+        f"import app.main took {result['seconds']:.2f} s, budget {import_time.BUDGET_SECONDS:.2f} s"
+
+
+def test_lazy_modules_not_imported(result):
+    assert not result["loaded"], f"imported eagerly: {', '.join(result['loaded'])}"